@@ -1,46 +1,204 @@
 import discord
-import requests
+from aiohttp import web
 import asyncio
+import json
+import os
 import sqlite3
-from sqlalchemy import create_engine, Column, Integer, String, Boolean
-from sqlalchemy.orm import declarative_base, sessionmaker
+import time
+import random
+import functools
+import hashlib
+import bisect
+import logging
+from datetime import datetime, timezone
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from discord.ext import commands
 from discord import app_commands
 from discord.ext.commands import CooldownMapping, BucketType
+from server_list import decode_server_list, download_server_list, close_http_session, read_file_bytes
 cooldown = CooldownMapping.from_cooldown(1, 2, BucketType.user)
+
+# Logging setup; debug output is only formatted when BSM_LOG_LEVEL=DEBUG
+logger = logging.getLogger("bsm")
+logger.setLevel(os.environ.get("BSM_LOG_LEVEL", "INFO").upper())
+if not logger.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-8s %(name)s: %(message)s"))
+    logger.addHandler(log_handler)
+
+# Bucket upper bounds for the histograms below
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = (1024, 16384, 65536, 262144, 524288, 1048576, 2097152, 4194304, 8388608)
+
+# Fixed-bucket histogram (Prometheus style, cumulative on export)
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # Function to estimate a quantile as the upper bound of the bucket it falls in
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+# Process-wide counters, gauges and histograms, keyed by (name, labels)
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}  # Format: {name: callable returning the current value}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def gauge(self, name, func):
+        self.gauges[name] = func
+
+    def counter_value(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name, **labels):
+        return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    # Function to render everything in the Prometheus text format
+    def render(self):
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}" if pairs else ""
+
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}{label_text(labels)} {value}")
+        for name, func in sorted(self.gauges.items()):
+            lines.append(f"{name} {func()}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{label_text(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{label_text(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{label_text(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# Command tree that stamps every interaction so command latency can be measured,
+# and answers (and records) every failed or denied command.
+# discord.py routes app command errors here, not to an on_app_command_error event.
+class InstrumentedCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction):
+        interaction.extras["started"] = time.perf_counter()
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        observe_command(interaction, interaction.command, type(error).__name__)
+        if isinstance(error, app_commands.errors.MissingPermissions):
+            missing = ", ".join(permission.replace("_", " ").title() for permission in error.missing_permissions)
+            message = f"❌ You don't have permission to use this command. You need the **{missing}** permission."
+        elif isinstance(error, app_commands.CommandOnCooldown):
+            message = f"⏳ This command is on cooldown. Try again in **{error.retry_after:.1f} seconds**."
+        else:
+            logger.error("Command %s failed", interaction.command.qualified_name if interaction.command else "unknown", exc_info=error)
+            message = "❌ An unexpected error occurred. Please try again later."
+        try:
+            # Deferred commands (e.g. listservers) have to answer through the followup webhook
+            if interaction.response.is_done():
+                await interaction.followup.send(message, ephemeral=True)
+            else:
+                await interaction.response.send_message(message, ephemeral=True)
+        except discord.HTTPException:
+            logger.warning("Could not report the error to the user", exc_info=True)
+
+# Function to record how long a slash command took
+def observe_command(interaction, command, outcome):
+    name = command.qualified_name if command is not None else "unknown"
+    started = interaction.extras.get("started")
+    if started is not None:
+        metrics.observe("bsm_command_seconds", time.perf_counter() - started, command=name)
+    metrics.inc("bsm_commands_total", command=name, outcome=outcome)
+
+# Sharding setup. BSM_SHARD_COUNT=auto runs every shard Discord recommends in this process;
+# a number plus BSM_SHARD_IDS (e.g. "0,1") runs just those shards, one process per group.
+SHARD_COUNT = os.environ.get("BSM_SHARD_COUNT")
+SHARD_IDS = [int(shard_id) for shard_id in os.environ["BSM_SHARD_IDS"].split(",")] if os.environ.get("BSM_SHARD_IDS") else None
+
+# Function to tell whether this process owns a guild (Discord routes guild_id >> 22 % shard_count)
+def owns_guild(guild_id):
+    if not SHARD_COUNT or SHARD_COUNT == "auto" or SHARD_IDS is None:
+        return True
+    return (int(guild_id) >> 22) % int(SHARD_COUNT) in SHARD_IDS
+
+# Bot whose background work is owned by the lifecycle manager: started once from setup_hook
+# (which, unlike on_ready, does not run again on gateway reconnects) and drained on close
+class BSMBot(commands.AutoShardedBot if SHARD_COUNT else commands.Bot):
+    async def setup_hook(self):
+        await lifecycle.start()
+
+    async def close(self):
+        await lifecycle.stop()
+        await super().close()
+
+# Longest rate limit (seconds) discord.py sleeps through on its own; longer ones raise discord.RateLimited,
+# so the alert dispatcher can back off that channel without holding a send slot (30 is the library minimum)
+RATELIMIT_TIMEOUT = 30
+
 # Initialize the bot with a command prefix (not used for slash commands)
 intents = discord.Intents.default()
-bot = commands.Bot(command_prefix="!", intents=intents)
+if SHARD_COUNT and SHARD_COUNT != "auto":
+    bot = BSMBot(command_prefix="!", intents=intents, tree_cls=InstrumentedCommandTree, max_ratelimit_timeout=RATELIMIT_TIMEOUT,
+                 shard_count=int(SHARD_COUNT), shard_ids=SHARD_IDS)
+else:
+    bot = BSMBot(command_prefix="!", intents=intents, tree_cls=InstrumentedCommandTree, max_ratelimit_timeout=RATELIMIT_TIMEOUT)
 
 @bot.event
-async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
-    if isinstance(error, app_commands.errors.MissingPermissions):
-        await interaction.response.send_message(
-            "❌ You don't have permission to use this command. You need the **Manage Channels** permission.",
-            ephemeral=True
-        )
-    elif isinstance(error, app_commands.CommandOnCooldown):
-        await interaction.response.send_message(
-            f"⏳ This command is on cooldown. Try again in **{error.retry_after:.1f} seconds**.",
-            ephemeral=True
-        )
-    else:
-        print(f"An error occurred: {error}")
-        await interaction.response.send_message(
-            "❌ An unexpected error occurred. Please try again later.",
-            ephemeral=True
-        )
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    observe_command(interaction, command, "ok")
 
 # SQLite database setup
-DATABASE_FILE = "bsm_configs.db"
+DATABASE_FILE = os.environ.get("BSM_DATABASE_FILE", "bsm_configs.db")
 
-# Track alert states
-alert_states = {}  # Format: {guild_id: {"server_alerts": {server_name: bool}, "map_alerts": {map_name: bool}}}
+# Single long-lived connection shared by everything that persists state.
+# All access goes through db_executor, so statements never run on the event loop
+# and never run concurrently.
+db_conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False, timeout=30)
+db_conn.execute("PRAGMA journal_mode=WAL")
+db_conn.execute("PRAGMA synchronous=NORMAL")
+db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bsm-db")
+
+# Function to run a blocking database call on the database thread
+async def run_db(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args))
 
 # Function to initialize the database
 def init_db():
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
+    c = db_conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS configs
                  (alert_id INTEGER PRIMARY KEY AUTOINCREMENT,
                   guild_id TEXT,
@@ -50,117 +208,599 @@ def init_db():
                   channel_id TEXT,
                   ping_role_id TEXT,
                   below_warning_enabled INTEGER DEFAULT 0)''')  # 0 = disabled, 1 = enabled
-    conn.commit()
-    conn.close()
-
-DATABASE_URL = "sqlite:///bsm_configs.db"
-engine = create_engine(DATABASE_URL)
-Base = declarative_base()
-
-class Config(Base):
-    __tablename__ = 'configs'
-    alert_id = Column(Integer, primary_key=True, autoincrement=True)
-    guild_id = Column(String)
-    alert_name = Column(String)
-    alert_map = Column(String)
-    min_players = Column(Integer)
-    channel_id = Column(String)
-    ping_role_id = Column(String)
-    below_warning_enabled = Column(Boolean)
-
-Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine)
-session = Session()
-
-def save_config(guild_id, alert_name, alert_map, min_players, channel_id, ping_role_id=None, below_warning_enabled=False):
-    config = Config(
-        guild_id=guild_id,
-        alert_name=alert_name,
-        alert_map=alert_map,
-        min_players=min_players,
-        channel_id=channel_id,
-        ping_role_id=ping_role_id,
-        below_warning_enabled=below_warning_enabled
-    )
-    session.add(config)
-    session.commit()
-
-def load_configs(guild_id):
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute('''SELECT alert_id, alert_name, alert_map, min_players, channel_id, ping_role_id, below_warning_enabled 
-                 FROM configs 
-                 WHERE guild_id = ?''', (guild_id,))
-    results = c.fetchall()
-    conn.close()
-    configs = []
-    for result in results:
-        config = {
-            "alert_id": result[0],
-            "alert_name": result[1],
-            "alert_map": result[2],
-            "min_players": result[3],
-            "channel_id": int(result[4]) if result[4] else None,
-            "ping_role_id": int(result[5]) if result[5] else None,
-            "below_warning_enabled": bool(result[6])
-        }
-        configs.append(config)
-        print(f"Loaded config: {config}")  # Debug logging
-    return configs
-
-# Function to update a configuration
-def update_config(alert_id, alert_name=None, alert_map=None, min_players=None, channel_id=None, ping_role_id=None, below_warning_enabled=None):
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    updates = []
-    params = []
-    if alert_name is not None:
-        updates.append("alert_name = ?")
-        params.append(alert_name)
-    if alert_map is not None:
-        updates.append("alert_map = ?")
-        params.append(alert_map)
-    if min_players is not None:
-        updates.append("min_players = ?")
-        params.append(min_players)
-    if channel_id is not None:
-        updates.append("channel_id = ?")
-        params.append(channel_id)
-    if ping_role_id is not None:
-        updates.append("ping_role_id = ?")
-        params.append(ping_role_id)
-    if below_warning_enabled is not None:
-        updates.append("below_warning_enabled = ?")
-        params.append(int(below_warning_enabled))
-        params.append(alert_id)
-        query = f"UPDATE configs SET {', '.join(updates)} WHERE alert_id = ?"
-        c.execute(query, params)
-        conn.commit()
-        conn.close()
-
-        # Function to delete a configuration
-def delete_config(alert_id):
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute('''DELETE FROM configs WHERE alert_id = ?''', (alert_id,))
-    conn.commit()
-    conn.close()
+    c.execute('''CREATE TABLE IF NOT EXISTS alert_states
+                 (alert_id INTEGER,
+                  kind INTEGER,
+                  target TEXT,
+                  PRIMARY KEY (alert_id, kind, target)) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS player_history
+                 (kind INTEGER,
+                  target TEXT,
+                  resolution INTEGER,
+                  bucket INTEGER,
+                  samples INTEGER,
+                  total INTEGER,
+                  min_players INTEGER,
+                  max_players INTEGER,
+                  PRIMARY KEY (kind, target, resolution, bucket)) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS boards
+                 (channel_id TEXT PRIMARY KEY,
+                  message_id TEXT,
+                  content_hash TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS meta
+                 (key TEXT PRIMARY KEY,
+                  value TEXT)''')
+    db_conn.commit()
+    migrate_db()
+
+# Columns added to configs after the first release: {name: column definition}
+CONFIG_MIGRATIONS = {
+    "alert_type": "TEXT DEFAULT 'threshold'",  # 'threshold' or 'rising'
+    "rise_players": "INTEGER",  # Rising alerts: players gained...
+    "rise_minutes": "INTEGER",  # ...within this many minutes
+    "mode": "TEXT DEFAULT 'alert'",  # 'alert' or 'board'
+    "clear_players": "INTEGER",  # Threshold alerts clear below this (NULL = min_players)...
+    "sustain_ticks": "INTEGER"  # ...and only switch once the new state held this many polls (NULL = 1)
+}
+
+# Function to add any configs columns an older database is missing.
+# Every worker process runs this at startup, so the check and the ALTERs hold the write lock together:
+# the others wait for it and then find the columns already there.
+def migrate_db():
+    db_conn.execute("BEGIN IMMEDIATE")
+    try:
+        existing = {row[1] for row in db_conn.execute("PRAGMA table_info(configs)")}
+        for column, definition in CONFIG_MIGRATIONS.items():
+            if column not in existing:
+                db_conn.execute(f"ALTER TABLE configs ADD COLUMN {column} {definition}")
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+
+# Columns of the configs table, in the order config_from_row expects them
+CONFIG_COLUMNS = ("alert_id", "guild_id", "alert_name", "alert_map", "min_players", "channel_id", "ping_role_id", "below_warning_enabled",
+                  "alert_type", "rise_players", "rise_minutes", "mode", "clear_players", "sustain_ticks")
+
+# Alert types
+ALERT_THRESHOLD = "threshold"  # Fires when players reach min_players
+ALERT_RISING = "rising"  # Fires when a server gains rise_players within rise_minutes
+RISE_PLAYERS_DEFAULT = 20
+RISE_MINUTES_DEFAULT = 10
+
+# Alert modes
+MODE_ALERT = "alert"  # Posts an embed (and ping) whenever the alert fires
+MODE_BOARD = "board"  # Keeps the channel's status board up to date, pinging only when the alert fires
+
+# Function to turn a configs row into the dict used throughout the bot
+def config_from_row(result):
+    return {
+        "alert_id": result[0],
+        "guild_id": result[1],
+        "alert_name": result[2],
+        "alert_map": result[3],
+        "min_players": result[4],
+        "channel_id": int(result[5]) if result[5] else None,
+        "ping_role_id": int(result[6]) if result[6] else None,
+        "below_warning_enabled": bool(result[7]),
+        "alert_type": result[8] or ALERT_THRESHOLD,
+        "rise_players": result[9],
+        "rise_minutes": result[10],
+        "mode": result[11] or MODE_ALERT,
+        "clear_players": result[12],
+        "sustain_ticks": result[13]
+    }
+
+# In-memory view of the configs table with write-through persistence.
+# Config dicts are never mutated in place: updates swap in a new dict, so readers
+# holding an older list (e.g. the monitor's matcher) always see a consistent row.
+class ConfigStore:
+    def __init__(self):
+        self.by_id = {}  # Format: {alert_id: config}
+        self.by_guild = {}  # Format: {guild_id: {alert_id: config}}
+        self.version = 0  # Bumped on every change so readers can rebuild derived indexes
+
+    # Function to load the configs of every guild this process owns (called once at startup)
+    def load(self):
+        c = db_conn.cursor()
+        c.execute(f"SELECT {', '.join(CONFIG_COLUMNS)} FROM configs ORDER BY alert_id")
+        self.by_id.clear()
+        self.by_guild.clear()
+        for row in c.fetchall():
+            if owns_guild(row[1]):
+                self._put(config_from_row(row))
+        self.version += 1
+
+    def _put(self, config):
+        self.by_id[config["alert_id"]] = config
+        self.by_guild.setdefault(config["guild_id"], {})[config["alert_id"]] = config
+
+    def get(self, alert_id, guild_id=None):
+        config = self.by_id.get(alert_id)
+        if config is None or (guild_id is not None and config["guild_id"] != guild_id):
+            return None
+        return config
+
+    def all(self):
+        return list(self.by_id.values())
+
+    def for_guild(self, guild_id):
+        return list(self.by_guild.get(guild_id, {}).values())
+
+    # Function to save a new configuration
+    async def add(self, guild_id, alert_name, alert_map, min_players, channel_id, ping_role_id=None, below_warning_enabled=False,
+                  alert_type=ALERT_THRESHOLD, rise_players=None, rise_minutes=None, mode=MODE_ALERT, clear_players=None, sustain_ticks=None):
+        values = (guild_id, alert_name, alert_map, min_players, channel_id, ping_role_id, int(below_warning_enabled),
+                  alert_type, rise_players, rise_minutes, mode, clear_players, sustain_ticks)
+        alert_id = await run_db(self._insert, values)
+        config = config_from_row((alert_id,) + values)
+        self._put(config)
+        self.version += 1
+        return config
+
+    @staticmethod
+    def _insert(values):
+        c = db_conn.execute(
+            f"INSERT INTO configs ({', '.join(CONFIG_COLUMNS[1:])}) VALUES ({', '.join('?' * len(values))})", values
+        )
+        db_conn.commit()
+        return c.lastrowid
+
+    # Function to update a configuration; only the fields that are not None change,
+    # columns listed in clear are set back to NULL
+    async def update(self, alert_id, clear=(), **changes):
+        config = self.by_id.get(alert_id)
+        changes = {column: value for column, value in changes.items() if value is not None}
+        changes.update((column, None) for column in clear)
+        if config is None or not changes:
+            return config
+
+        params = [int(value) if isinstance(value, bool) else value for value in changes.values()]
+        query = f"UPDATE configs SET {', '.join(f'{column} = ?' for column in changes)} WHERE alert_id = ?"
+        await run_db(self._execute, query, params + [alert_id])
+
+        # Re-read after the await: the alert may have been deleted meanwhile (it must not come back),
+        # or changed by another update (whose changes must not be lost)
+        config = self.by_id.get(alert_id)
+        if config is None:
+            return None
+        row = [config[column] for column in CONFIG_COLUMNS]
+        for column, value in changes.items():
+            row[CONFIG_COLUMNS.index(column)] = value
+        updated = config_from_row(row)
+        self._put(updated)
+        self.version += 1
+        return updated
+
+    # Function to delete a configuration
+    async def delete(self, alert_id):
+        config = self.by_id.get(alert_id)
+        if config is None:
+            return False
+        await run_db(self._execute, "DELETE FROM configs WHERE alert_id = ?", (alert_id,))
+        if self.by_id.pop(alert_id, None) is None:
+            # Already deleted by an overlapping call
+            return False
+        guild_configs = self.by_guild.get(config["guild_id"], {})
+        guild_configs.pop(alert_id, None)
+        if not guild_configs:
+            self.by_guild.pop(config["guild_id"], None)
+        self.version += 1
+        return True
+
+    @staticmethod
+    def _execute(query, params):
+        db_conn.execute(query, params)
+        db_conn.commit()
+
+# Which alerts are currently "on" for which server name / map.
+# Only active states are kept (inactive is the default), checkpointed to SQLite
+# incrementally and restored at startup so a deploy does not re-fire every alert.
+class AlertStateStore:
+    def __init__(self):
+        self.active = set()  # Format: {(alert_id, kind, target)}
+        self.by_target = {}  # Format: {(kind, target): {alert_id}}
+        self.dirty = {}  # Format: {(alert_id, kind, target): bool}, changes since the last checkpoint
+
+    # Function to restore the saved states of the given alerts (called once at startup).
+    # Other shard processes own the rest of the table, so their rows are left alone.
+    def load(self, alert_ids):
+        c = db_conn.cursor()
+        c.execute("SELECT alert_id, kind, target FROM alert_states")
+        for alert_id, kind, target in c.fetchall():
+            if alert_id in alert_ids:
+                self._add((alert_id, kind, target))
+
+    def _add(self, key):
+        self.active.add(key)
+        self.by_target.setdefault(key[1:], set()).add(key[0])
+
+    def _discard(self, key):
+        self.active.discard(key)
+        alert_ids = self.by_target.get(key[1:])
+        if alert_ids is not None:
+            alert_ids.discard(key[0])
+            if not alert_ids:
+                del self.by_target[key[1:]]
+
+    def is_active(self, alert_id, kind, target):
+        return (alert_id, kind, target) in self.active
+
+    def set(self, alert_id, kind, target, active):
+        key = (alert_id, kind, target)
+        if active == (key in self.active):
+            return
+        if active:
+            self._add(key)
+        else:
+            self._discard(key)
+        self.dirty[key] = active
+
+    # Function to forget every alert's state for targets that are no longer listed
+    def forget_targets(self, kind, targets):
+        for target in targets:
+            for alert_id in list(self.by_target.get((kind, target), ())):
+                self.set(alert_id, kind, target, False)
+
+    # Function to drop every state of deleted alerts
+    def forget_alerts(self, alert_ids):
+        if not alert_ids:
+            return
+        for key in [key for key in self.active if key[0] in alert_ids]:
+            self.set(key[0], key[1], key[2], False)
+
+    # Function to evict states of deleted alerts and of targets that are not live any more
+    def prune(self, live_alert_ids, live_targets):
+        for key in list(self.active):
+            if key[0] not in live_alert_ids or key[2] not in live_targets.get(key[1], ()):
+                self.set(key[0], key[1], key[2], False)
+
+    # Function to write the changes since the last checkpoint
+    async def checkpoint(self):
+        if not self.dirty:
+            return
+        changes, self.dirty = self.dirty, {}
+        try:
+            await run_db(self._write, changes)
+        except Exception:
+            # Keep the changes for the next checkpoint, newer ones win
+            changes.update(self.dirty)
+            self.dirty = changes
+            raise
+
+    @staticmethod
+    def _write(changes):
+        db_conn.executemany(
+            "INSERT OR IGNORE INTO alert_states (alert_id, kind, target) VALUES (?, ?, ?)",
+            [key for key, active in changes.items() if active]
+        )
+        db_conn.executemany(
+            "DELETE FROM alert_states WHERE alert_id = ? AND kind = ? AND target = ?",
+            [key for key, active in changes.items() if not active]
+        )
+        db_conn.commit()
+
+# History setup
+HISTORY_RING_SIZE = 240  # Raw samples kept in memory per server/map (4 hours at the fastest poll rate)
+HISTORY_RESOLUTIONS = {60: 24 * 3600, 900: 7 * 24 * 3600, 3600: 30 * 24 * 3600}  # Format: {bucket seconds: retention seconds}
+HISTORY_SWEEP_INTERVAL = 3600
+
+# Fixed-size, array-backed ring of (timestamp, players) samples
+class RingBuffer:
+    __slots__ = ("times", "values", "start", "size")
+
+    def __init__(self, capacity=HISTORY_RING_SIZE):
+        self.times = array("I", bytes(4 * capacity))
+        self.values = array("H", bytes(2 * capacity))
+        self.start = 0
+        self.size = 0
+
+    def append(self, timestamp, value):
+        capacity = len(self.times)
+        index = (self.start + self.size) % capacity
+        self.times[index] = timestamp
+        self.values[index] = min(value, 65535)
+        if self.size < capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % capacity
+
+    def last_time(self):
+        return self.times[(self.start + self.size - 1) % len(self.times)] if self.size else 0
+
+    def first_time(self):
+        return self.times[self.start] if self.size else 0
+
+    # Function to list the samples taken at or after since, oldest first
+    def samples(self, since=0):
+        capacity = len(self.times)
+        points = []
+        for offset in range(self.size):
+            index = (self.start + offset) % capacity
+            if self.times[index] >= since:
+                points.append((self.times[index], self.values[index]))
+        return points
+
+# Function to name a server's history series. Servers in different regions can share a name,
+# so they are told apart by region as well (as index_servers does).
+def server_history_target(server):
+    return f"{server.region}/{server.name}"
+
+# Player counts over time for every server and map.
+# Recent samples live in ring buffers; 1-minute, 15-minute and hourly rollups go to SQLite.
+class PlayerHistory:
+    def __init__(self):
+        self.rings = {}  # Format: {(kind, target): RingBuffer}, target is "region/name" for servers
+        self.buckets = {}  # Format: {(kind, target, resolution): [bucket, samples, total, min, max]}
+        self.pending = []  # Completed rollup rows waiting to be written
+        self.last_sweep = 0
+
+    # Function to take one sample of every listed server, and of every map's total
+    def record(self, servers, now=None):
+        now = int(now or time.time())
+        map_totals = {}
+        for server in servers:
+            self._add(MATCH_NAME, server_history_target(server), now, server.players)
+            map_totals[server.map] = map_totals.get(server.map, 0) + server.players
+        for map_name, players in map_totals.items():
+            self._add(MATCH_MAP, map_name, now, players)
+
+    def _add(self, kind, target, now, players):
+        ring = self.rings.get((kind, target))
+        if ring is None:
+            ring = self.rings[(kind, target)] = RingBuffer()
+        if ring.size and ring.last_time() == now:
+            return
+        ring.append(now, players)
+        for resolution in HISTORY_RESOLUTIONS:
+            bucket = now - now % resolution
+            rollup = self.buckets.get((kind, target, resolution))
+            if rollup is None or rollup[0] != bucket:
+                if rollup is not None:
+                    self.pending.append((kind, target, resolution, *rollup))
+                self.buckets[(kind, target, resolution)] = [bucket, 1, players, players, players]
+            else:
+                rollup[1] += 1
+                rollup[2] += players
+                rollup[3] = min(rollup[3], players)
+                rollup[4] = max(rollup[4], players)
+
+    # Function to find how many players a server gained over the last window seconds
+    def gain(self, server, window, now=None):
+        ring = self.rings.get((MATCH_NAME, server_history_target(server)))
+        if ring is None or ring.size < 2:
+            return 0
+        now = int(now or ring.last_time())
+        points = ring.samples(now - window)
+        if len(points) < 2:
+            return 0
+        return points[-1][1] - min(players for _, players in points)
+
+    # Function to find a tracked server or map by name (exact match first, then substring),
+    # optionally only among the servers of one region
+    def find(self, kind, query, region=None):
+        query = query.lower()
+        region = region.lower() if region else None
+        partial = None
+        for ring_kind, target in self.rings:
+            if ring_kind != kind:
+                continue
+            name = target
+            if kind == MATCH_NAME:
+                target_region, _, name = target.partition("/")
+                if region is not None and target_region.lower() != region:
+                    continue
+            if name.lower() == query:
+                return target
+            if partial is None and query in name.lower():
+                partial = target
+        return partial
+
+    # Function to load (timestamp, players) points covering the last seconds for one server or map
+    async def load(self, kind, target, seconds, now=None):
+        now = int(now or time.time())
+        since = now - seconds
+        ring = self.rings.get((kind, target))
+        if ring is not None and ring.size and ring.first_time() <= since:
+            return ring.samples(since)
+
+        # Older than the ring: read the finest rollup that still covers the range
+        resolution = min(res for res, retention in HISTORY_RESOLUTIONS.items() if retention >= seconds or res == 3600)
+        rows = await run_db(self._query, kind, target, resolution, since)
+        points = [(bucket, round(total / samples)) for bucket, samples, total in rows]
+        if ring is not None:
+            newest = points[-1][0] + resolution if points else since
+            points.extend(ring.samples(newest))
+        return points
+
+    @staticmethod
+    def _query(kind, target, resolution, since):
+        return db_conn.execute(
+            "SELECT bucket, samples, total FROM player_history WHERE kind = ? AND target = ? AND resolution = ? AND bucket >= ? ORDER BY bucket",
+            (kind, target, resolution, since)
+        ).fetchall()
+
+    # Function to write completed rollups, and every hour drop idle series and expired rows
+    async def flush(self, now=None):
+        now = int(now or time.time())
+        sweep = now - self.last_sweep >= HISTORY_SWEEP_INTERVAL
+        if sweep:
+            self.last_sweep = now
+            for key, rollup in list(self.buckets.items()):
+                if rollup[0] + key[2] < now - key[2]:
+                    self.pending.append((*key, *rollup))
+                    del self.buckets[key]
+            idle = now - HISTORY_RING_SIZE * POLL_INTERVAL_MAX
+            for key, ring in list(self.rings.items()):
+                if ring.last_time() < idle:
+                    del self.rings[key]
+        if not self.pending and not sweep:
+            return
+        rows, self.pending = self.pending, []
+        await run_db(self._write, rows, now if sweep else None)
+
+    @staticmethod
+    def _write(rows, expire_before):
+        db_conn.executemany("INSERT OR REPLACE INTO player_history VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        if expire_before is not None:
+            for resolution, retention in HISTORY_RESOLUTIONS.items():
+                db_conn.execute("DELETE FROM player_history WHERE resolution = ? AND bucket < ?", (resolution, expire_before - retention))
+        db_conn.commit()
+
+player_history = PlayerHistory()
+
+# Each channel's status board message, so boards keep being edited in place across restarts
+class BoardStore:
+    def __init__(self):
+        self.boards = {}  # Format: {channel_id: (message_id, content_hash)}
+
+    # Function to load the saved boards (called once at startup)
+    def load(self):
+        for channel_id, message_id, content_hash in db_conn.execute("SELECT channel_id, message_id, content_hash FROM boards"):
+            self.boards[int(channel_id)] = (int(message_id) if message_id else None, content_hash)
+
+    def get(self, channel_id):
+        return self.boards.get(channel_id, (None, None))
+
+    # Function to remember the message a board was published to and what it shows
+    async def save(self, channel_id, message_id, content_hash):
+        self.boards[channel_id] = (message_id, content_hash)
+        await run_db(self._execute, "INSERT OR REPLACE INTO boards (channel_id, message_id, content_hash) VALUES (?, ?, ?)",
+                     (str(channel_id), str(message_id), content_hash))
+
+    # Function to drop the board of a deleted channel
+    async def forget(self, channel_id):
+        if self.boards.pop(channel_id, None) is not None:
+            await run_db(self._execute, "DELETE FROM boards WHERE channel_id = ?", (str(channel_id),))
+
+    @staticmethod
+    def _execute(query, params):
+        db_conn.execute(query, params)
+        db_conn.commit()
+
+# Function to draw points as a one-line sparkline of at most width columns
+def render_sparkline(points, width=40):
+    if not points:
+        return ""
+    blocks = "▁▂▃▄▅▆▇█"
+    step = max(1, -(-len(points) // width))
+    columns = [max(players for _, players in points[i:i + step]) for i in range(0, len(points), step)]
+    low, high = min(columns), max(columns)
+    span = (high - low) or 1
+    return "".join(blocks[(value - low) * (len(blocks) - 1) // span] for value in columns)
 
 # Initialize the database
 init_db()
+config_store = ConfigStore()
+config_store.load()
+alert_state_store = AlertStateStore()
+alert_state_store.load(set(config_store.by_id))
+board_store = BoardStore()
+board_store.load()
+
+# Validators and body of the last successful fetch, used for conditional requests
+server_list_cache = {"etag": None, "last_modified": None, "file_stamp": None, "servers": None}
+
+# Timings of the last fetch: seconds on the wire, seconds decoding, payload bytes (0 when not modified)
+fetch_stats = {"fetch": 0.0, "parse": 0.0, "bytes": 0}
+
+# Function to fetch the server list without blocking the event loop
+async def fetch_server_list():
+    if SNAPSHOT_FILE:
+        return await read_snapshot_file()
+
+    cached = server_list_cache["servers"] is not None
+    started = time.perf_counter()
+    body, etag, last_modified = await download_server_list(
+        server_list_cache["etag"] if cached else None,
+        server_list_cache["last_modified"] if cached else None
+    )
+    fetched = time.perf_counter()
+
+    # Nothing changed upstream, reuse the list we already decoded
+    if body is None and cached:
+        fetch_stats.update(fetch=fetched - started, parse=0.0, bytes=0)
+        return server_list_cache["servers"]
+
+    # The payload is large, decode it in a worker thread so heartbeats keep flowing
+    servers = await asyncio.to_thread(decode_server_list, body)
+    fetch_stats.update(fetch=fetched - started, parse=time.perf_counter() - fetched, bytes=len(body))
+    server_list_cache["etag"] = etag
+    server_list_cache["last_modified"] = last_modified
+    server_list_cache["servers"] = servers
+    return servers
+
+# Scale-out setup: when BSM_SNAPSHOT_FILE is set, this process never calls the API itself
+# and reads the list a single snapshot_fetcher.py process publishes to that file instead
+SNAPSHOT_FILE = os.environ.get("BSM_SNAPSHOT_FILE")
+
+# Function to read the published snapshot file, decoding it only when it was replaced
+async def read_snapshot_file():
+    started = time.perf_counter()
+    stat = os.stat(SNAPSHOT_FILE)
+    stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if stamp == server_list_cache["file_stamp"] and server_list_cache["servers"] is not None:
+        fetch_stats.update(fetch=time.perf_counter() - started, parse=0.0, bytes=0)
+        return server_list_cache["servers"]
+
+    body = await asyncio.to_thread(read_file_bytes, SNAPSHOT_FILE)
+    fetched = time.perf_counter()
+    servers = await asyncio.to_thread(decode_server_list, body)
+    fetch_stats.update(fetch=fetched - started, parse=time.perf_counter() - fetched, bytes=len(body))
+    server_list_cache["file_stamp"] = stamp
+    server_list_cache["servers"] = servers
+    return servers
+
+# How long a server list snapshot is served to readers before it is refreshed
+SNAPSHOT_TTL = 30
+
+# Immutable view of the server list as of one fetch
+class ServerSnapshot:
+    __slots__ = ("servers", "version", "fetched_at")
+
+    def __init__(self, servers, version, fetched_at):
+        object.__setattr__(self, "servers", servers)
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "fetched_at", fetched_at)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ServerSnapshot is immutable")
+
+    def age(self):
+        return time.monotonic() - self.fetched_at
+
+# Latest snapshot and the refresh currently in flight (if any)
+current_snapshot = None
+snapshot_refresh = None
+
+# Function to fetch a new snapshot, bumping the version only when the list actually changed
+async def refresh_snapshot():
+    global current_snapshot
+    servers = tuple(await fetch_server_list())
+    previous = current_snapshot
+    if previous is not None and previous.servers == servers:
+        version = previous.version
+        servers = previous.servers
+    else:
+        version = previous.version + 1 if previous is not None else 1
+    current_snapshot = ServerSnapshot(servers, version, time.monotonic())
+    return current_snapshot
+
+# Function to get the shared server list snapshot, refreshing it if it is stale
+async def get_server_snapshot(max_age=SNAPSHOT_TTL):
+    global snapshot_refresh
+    if current_snapshot is not None and current_snapshot.age() < max_age:
+        return current_snapshot
+
+    # Everyone arriving during a refresh awaits the same fetch
+    if snapshot_refresh is None or snapshot_refresh.done():
+        snapshot_refresh = asyncio.ensure_future(refresh_snapshot())
+    return await asyncio.shield(snapshot_refresh)
 
 @bot.event
 async def on_ready():
-    print(f'Logged in as {bot.user}')
-    try:
-        # Sync slash commands
-        synced = await bot.tree.sync()
-        print(f"Synced {len(synced)} command(s)")
-    except Exception as e:
-        print(f"Error syncing commands: {e}")
-
-    # Start the monitoring task
-    bot.loop.create_task(monitor_api())
+    # Fires again on every reconnect, so nothing is started from here (see LifecycleManager)
+    logger.info("Logged in as %s", bot.user)
 
 # Event when the bot joins a new server
 @bot.event
@@ -184,6 +824,7 @@ async def on_guild_join(guild):
             "`/BSM DeleteAlert` - Delete an alert configuration.\n"
             "`/BSM ToggleBelowWarning` - Enable or disable alerts when player count drops below the threshold.\n"
             "`/BSM ListServers` - List all servers matching specific parameters.\n"
+            "`/BSM History` - Show the recent player count of a server or map.\n"
             "`/BSM Help` - Get help and instructions for using the bot.\n\n"
             "**Example:**\n"
             "`/BSM Setup alert_name: Elite Soldiers min_players: 50 channel: #alerts ping_role: @Role`\n"
@@ -191,6 +832,81 @@ async def on_guild_join(guild):
             "You can also combine both server name and map alerts in one command!\n\n"
         )
 
+# Autocomplete setup
+AUTOCOMPLETE_LIMIT = 25  # Discord shows at most 25 choices
+
+# Sorted, case-insensitive index of one field's values: prefix matches via binary search,
+# then substring matches to fill the remaining slots
+class AutocompleteIndex:
+    def __init__(self, values):
+        self.values = sorted(set(values), key=str.lower)
+        self.keys = [value.lower() for value in self.values]
+
+    def suggest(self, query, limit=AUTOCOMPLETE_LIMIT):
+        query = query.strip().lower()
+        if not query:
+            return self.values[:limit]
+        results = []
+        position = bisect.bisect_left(self.keys, query)
+        while position < len(self.keys) and self.keys[position].startswith(query) and len(results) < limit:
+            results.append(self.values[position])
+            position += 1
+        if len(results) < limit:
+            for key, value in zip(self.keys, self.values):
+                if query in key and not key.startswith(query):
+                    results.append(value)
+                    if len(results) >= limit:
+                        break
+        return results
+
+    def __contains__(self, value):
+        position = bisect.bisect_left(self.keys, value.lower())
+        return position < len(self.keys) and self.keys[position] == value.lower()
+
+# Indexes built from the latest snapshot; rebuilt lazily when its version changes
+autocomplete_indexes = {"version": None}
+
+# Function to get the autocomplete index for a server field, without any network or DB access
+def get_autocomplete_index(field):
+    snapshot = current_snapshot
+    if snapshot is None:
+        return AutocompleteIndex(())
+    if autocomplete_indexes["version"] != snapshot.version:
+        autocomplete_indexes.update(
+            version=snapshot.version,
+            name=AutocompleteIndex(server.name for server in snapshot.servers),
+            map=AutocompleteIndex(server.map for server in snapshot.servers),
+            region=AutocompleteIndex(server.region for server in snapshot.servers),
+            gamemode=AutocompleteIndex(server.gamemode for server in snapshot.servers)
+        )
+    return autocomplete_indexes[field]
+
+def autocomplete_choices(field, current):
+    return [app_commands.Choice(name=value[:100], value=value[:100]) for value in get_autocomplete_index(field).suggest(current)]
+
+async def autocomplete_server_name(interaction: discord.Interaction, current: str):
+    return autocomplete_choices("name", current)
+
+async def autocomplete_map(interaction: discord.Interaction, current: str):
+    return autocomplete_choices("map", current)
+
+async def autocomplete_region(interaction: discord.Interaction, current: str):
+    return autocomplete_choices("region", current)
+
+async def autocomplete_gamemode(interaction: discord.Interaction, current: str):
+    return autocomplete_choices("gamemode", current)
+
+# Function to warn about an alert name/map that nothing in the current list matches (likely a typo)
+def describe_unmatched(alert_name, alert_map):
+    if current_snapshot is None:
+        return ""
+    warnings = ""
+    if alert_map and alert_map not in get_autocomplete_index("map"):
+        warnings += f"\n⚠️ No server is currently on a map called **{alert_map}**, check the spelling."
+    if alert_name and not any(alert_name.lower() in server.name_key for server in current_snapshot.servers):
+        warnings += f"\n⚠️ No current server name contains **{alert_name}**."
+    return warnings
+
 # Create a command group for BSM
 bsm_group = app_commands.Group(name="bsm", description="BattleBit Server Monitor commands")
 
@@ -202,11 +918,43 @@ bsm_group = app_commands.Group(name="bsm", description="BattleBit Server Monitor
     alert_map="The map to monitor (leave blank if not needed).",
     min_players="The minimum number of players to trigger an alert.",
     channel="The channel where alerts will be sent (required).",
-    ping_role="The role to ping when an alert is triggered (leave blank if not needed)."
+    ping_role="The role to ping when an alert is triggered (leave blank if not needed).",
+    alert_type="Alert when the player count reaches min_players, or when a server is rising fast.",
+    rise_players="Rising alerts: how many players a server has to gain (default 20).",
+    rise_minutes="Rising alerts: within how many minutes (default 10).",
+    mode="Post a message per alert, or keep one pinned status board in the channel up to date.",
+    clear_players="Only clear the alert once players drop below this (default: min_players).",
+    sustain_ticks="Only fire or clear once the change held for this many polls in a row (default 1)."
 )
-async def setup(interaction: discord.Interaction, channel: discord.TextChannel, alert_name: str = None, alert_map: str = None, min_players: int = None, ping_role: discord.Role = None):
+@app_commands.choices(alert_type=[
+    app_commands.Choice(name="Player threshold", value=ALERT_THRESHOLD),
+    app_commands.Choice(name="Rising fast", value=ALERT_RISING)
+], mode=[
+    app_commands.Choice(name="Alert messages", value=MODE_ALERT),
+    app_commands.Choice(name="Status board", value=MODE_BOARD)
+])
+@app_commands.autocomplete(alert_name=autocomplete_server_name, alert_map=autocomplete_map)
+async def setup(interaction: discord.Interaction, channel: discord.TextChannel, alert_name: str = None, alert_map: str = None, min_players: int = None, ping_role: discord.Role = None,
+                alert_type: str = ALERT_THRESHOLD, rise_players: app_commands.Range[int, 1, 254] = None, rise_minutes: app_commands.Range[int, 1, 240] = None,
+                mode: str = MODE_ALERT, clear_players: app_commands.Range[int, 0, 254] = None, sustain_ticks: app_commands.Range[int, 1, 30] = None):
+    if clear_players is not None and clear_players > (min_players or 0):
+        await interaction.response.send_message("clear_players can't be higher than min_players.", ephemeral=True)
+        return
+
     # Save the user's configuration for this server
-    save_config(str(interaction.guild.id), alert_name, alert_map, min_players, str(channel.id), str(ping_role.id) if ping_role else None)
+    await config_store.add(
+        str(interaction.guild.id), alert_name, alert_map, min_players, str(channel.id), str(ping_role.id) if ping_role else None,
+        alert_type=alert_type,
+        rise_players=rise_players if alert_type == ALERT_RISING else None,
+        rise_minutes=rise_minutes if alert_type == ALERT_RISING else None,
+        mode=mode,
+        clear_players=clear_players,
+        sustain_ticks=sustain_ticks
+    )
+    rising = (
+        f"Rising Fast: +{rise_players or RISE_PLAYERS_DEFAULT} players within {rise_minutes or RISE_MINUTES_DEFAULT} minutes\n"
+        if alert_type == ALERT_RISING else ""
+    )
 
     # Confirm the setup
     await interaction.response.send_message(
@@ -214,17 +962,21 @@ async def setup(interaction: discord.Interaction, channel: discord.TextChannel,
         f"Server Name: {alert_name if alert_name else 'Not set'}\n"
         f"Map: {alert_map if alert_map else 'Not set'}\n"
         f"Minimum Players: {min_players}\n"
-        f"Notifications will be sent to: {channel.mention}\n"
-        f"Ping Role: {ping_role.mention if ping_role else 'Not set'}", ephemeral=True
+        f"{f'Clears Below: {clear_players} players' + chr(10) if clear_players is not None else ''}"
+        f"{f'Sustain: {sustain_ticks} polls' + chr(10) if sustain_ticks else ''}"
+        f"{rising}"
+        f"{'Status board' if mode == MODE_BOARD else 'Notifications'} will be sent to: {channel.mention}\n"
+        f"Ping Role: {ping_role.mention if ping_role else 'Not set'}"
+        f"{describe_unmatched(alert_name, alert_map)}", ephemeral=True
     )
 
 @bsm_group.command(name="listalerts", description="List all configured alerts.")
 @app_commands.checks.has_permissions(manage_channels=True)
 async def list_alerts(interaction: discord.Interaction):
     guild_id = str(interaction.guild.id)
-    print(f"Fetching alerts for guild ID: {guild_id}")  # Debug logging
-    configs = load_configs(guild_id)
-    print(f"Loaded configs: {configs}")  # Debug logging
+    logger.debug("Fetching alerts for guild ID: %s", guild_id)
+    configs = config_store.for_guild(guild_id)
+    logger.debug("Loaded configs: %s", configs)
 
     if not configs:
         await interaction.response.send_message("No alerts are currently configured.", ephemeral=True)
@@ -233,17 +985,35 @@ async def list_alerts(interaction: discord.Interaction):
     # Build the alert list message
     alert_message = "**Configured Alerts:**\n"
     for config in configs:
+        if config["alert_type"] == ALERT_RISING:
+            alert_type = f"Rising Fast (+{config['rise_players'] or RISE_PLAYERS_DEFAULT} players within {config['rise_minutes'] or RISE_MINUTES_DEFAULT} minutes)"
+        else:
+            alert_type = "Player threshold"
+        channel = f"<#{config['channel_id']}>" if config["channel_id"] is not None else "Not set"
+        ping_role = f"<@&{config['ping_role_id']}>" if config["ping_role_id"] is not None else "Not set"
         alert_message += (
-                             f"**Alert ID:** {config['alert_id']}\n"
-                             f"Server Name: {config['alert_name'] if config['alert_name'] is not None else 'Not set'}\n"
-                             f"Map: {config['alert_map'] if config['alert_map'] is not None else 'Not set'}\n"
-                             f"Minimum Players: {config['min_players'] if config['min_players'] is not None else 'Not set'}\n"
-                             f"Channel: <#{config['channel_id']}>" if config['channel_id'] is not None else "Channel: Not set\n"
-                                                                                                            f"Ping Role: <@&{config['ping_role_id']}>" if config['ping_role_id'] is not None else "Ping Role: Not set\n"
-                         ) + "\n\n"
+            f"**Alert ID:** {config['alert_id']}\n"
+            f"Server Name: {config['alert_name'] if config['alert_name'] is not None else 'Not set'}\n"
+            f"Map: {config['alert_map'] if config['alert_map'] is not None else 'Not set'}\n"
+            f"Minimum Players: {config['min_players'] if config['min_players'] is not None else 'Not set'}\n"
+            f"Clears Below: {config['clear_players'] if config['clear_players'] is not None else 'Minimum Players'}\n"
+            f"Sustain: {config['sustain_ticks'] or 1} poll(s)\n"
+            f"Type: {alert_type}\n"
+            f"Mode: {'Status board' if config['mode'] == MODE_BOARD else 'Alert messages'}\n"
+            f"Channel: {channel}\n"
+            f"Ping Role: {ping_role}"
+        ) + "\n\n"
 
     await interaction.response.send_message(alert_message, ephemeral=True)
 
+# Settings /bsm editalert can put back to their defaults: {choice: columns set back to NULL}
+EDIT_RESETS = {
+    "clear_players": ("clear_players",),  # Clear at min_players again
+    "sustain_ticks": ("sustain_ticks",),  # Fire and clear on the first poll again
+    "mode": ("mode",),  # Alert messages
+    "alert_type": ("alert_type", "rise_players", "rise_minutes")  # Player threshold
+}
+
 # Add the EditAlert command under the BSM group
 @bsm_group.command(name="editalert", description="Edit an existing alert.")
 @app_commands.checks.has_permissions(manage_channels=True)
@@ -253,14 +1023,67 @@ async def list_alerts(interaction: discord.Interaction):
     alert_map="The new map to monitor (leave blank to keep current).",
     min_players="The new minimum number of players to trigger an alert (leave blank to keep current).",
     channel="The new channel where alerts will be sent (leave blank to keep current).",
-    ping_role="The new role to ping when an alert is triggered (leave blank to keep current)."
+    ping_role="The new role to ping when an alert is triggered (leave blank to keep current).",
+    mode="Switch between alert messages and the channel's status board (leave blank to keep current).",
+    clear_players="Only clear the alert once players drop below this (leave blank to keep current).",
+    sustain_ticks="Only fire or clear once the change held for this many polls in a row (leave blank to keep current).",
+    alert_type="Switch between a player threshold and a rising fast alert (leave blank to keep current).",
+    rise_players="Rising alerts: how many players a server has to gain (leave blank to keep current).",
+    rise_minutes="Rising alerts: within how many minutes (leave blank to keep current).",
+    reset="Put one setting back to its default."
 )
-async def edit_alert(interaction: discord.Interaction, alert_id: int, alert_name: str = None, alert_map: str = None, min_players: int = None, channel: discord.TextChannel = None, ping_role: discord.Role = None):
+@app_commands.choices(mode=[
+    app_commands.Choice(name="Alert messages", value=MODE_ALERT),
+    app_commands.Choice(name="Status board", value=MODE_BOARD)
+], alert_type=[
+    app_commands.Choice(name="Player threshold", value=ALERT_THRESHOLD),
+    app_commands.Choice(name="Rising fast", value=ALERT_RISING)
+], reset=[
+    app_commands.Choice(name="Clear below (back to min_players)", value="clear_players"),
+    app_commands.Choice(name="Sustain (back to 1 poll)", value="sustain_ticks"),
+    app_commands.Choice(name="Mode (back to alert messages)", value="mode"),
+    app_commands.Choice(name="Alert type (back to player threshold)", value="alert_type")
+])
+@app_commands.autocomplete(alert_name=autocomplete_server_name, alert_map=autocomplete_map)
+async def edit_alert(interaction: discord.Interaction, alert_id: int, alert_name: str = None, alert_map: str = None, min_players: int = None, channel: discord.TextChannel = None, ping_role: discord.Role = None,
+                     mode: str = None, clear_players: app_commands.Range[int, 0, 254] = None, sustain_ticks: app_commands.Range[int, 1, 30] = None,
+                     alert_type: str = None, rise_players: app_commands.Range[int, 1, 254] = None, rise_minutes: app_commands.Range[int, 1, 240] = None,
+                     reset: str = None):
+    config = config_store.get(alert_id, str(interaction.guild.id))
+    if config is None:
+        await interaction.response.send_message(f"Alert **{alert_id}** not found.", ephemeral=True)
+        return
+    clear = EDIT_RESETS.get(reset, ())
+    if alert_type == ALERT_THRESHOLD:
+        # Threshold alerts have no rising settings
+        clear += ("rise_players", "rise_minutes")
+    new_min_players = min_players if min_players is not None else config["min_players"]
+    new_clear_players = clear_players if clear_players is not None else config["clear_players"]
+    if "clear_players" in clear:
+        new_clear_players = None
+    if new_clear_players is not None and new_clear_players > (new_min_players or 0):
+        await interaction.response.send_message("clear_players can't be higher than min_players.", ephemeral=True)
+        return
+
     # Update the configuration
-    update_config(alert_id, alert_name, alert_map, min_players, str(channel.id) if channel else None, str(ping_role.id) if ping_role else None)
+    await config_store.update(
+        alert_id,
+        clear=clear,
+        alert_name=alert_name,
+        alert_map=alert_map,
+        min_players=min_players,
+        channel_id=str(channel.id) if channel else None,
+        ping_role_id=str(ping_role.id) if ping_role else None,
+        mode=mode,
+        clear_players=clear_players,
+        sustain_ticks=sustain_ticks,
+        alert_type=alert_type,
+        rise_players=rise_players if alert_type != ALERT_THRESHOLD else None,
+        rise_minutes=rise_minutes if alert_type != ALERT_THRESHOLD else None
+    )
 
     # Confirm the update
-    await interaction.response.send_message(f"Alert **{alert_id}** has been updated.", ephemeral=True)
+    await interaction.response.send_message(f"Alert **{alert_id}** has been updated.{describe_unmatched(alert_name, alert_map)}", ephemeral=True)
 
 # Add the DeleteAlert command under the BSM group
 @bsm_group.command(name="deletealert", description="Delete an alert configuration.")
@@ -269,8 +1092,12 @@ async def edit_alert(interaction: discord.Interaction, alert_id: int, alert_name
     alert_id="The ID of the alert to delete."
 )
 async def delete_alert(interaction: discord.Interaction, alert_id: int):
+    if config_store.get(alert_id, str(interaction.guild.id)) is None:
+        await interaction.response.send_message(f"Alert **{alert_id}** not found.", ephemeral=True)
+        return
+
     # Delete the configuration
-    delete_config(alert_id)
+    await config_store.delete(alert_id)
 
     # Confirm the deletion
     await interaction.response.send_message(f"Alert **{alert_id}** has been deleted.", ephemeral=True)
@@ -283,24 +1110,109 @@ async def delete_alert(interaction: discord.Interaction, alert_id: int):
 )
 async def toggle_below_warning(interaction: discord.Interaction, alert_id: int):
     # Load the current configuration
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute('''SELECT below_warning_enabled FROM configs WHERE alert_id = ?''', (alert_id,))
-    result = c.fetchone()
-    conn.close()
-    if not result:
+    config = config_store.get(alert_id, str(interaction.guild.id))
+    if config is None:
         await interaction.response.send_message(f"Alert **{alert_id}** not found.", ephemeral=True)
         return
 
     # Toggle the below warning setting
-    new_setting = not bool(result[0])
-    update_config(alert_id, below_warning_enabled=new_setting)
+    new_setting = not config["below_warning_enabled"]
+    await config_store.update(alert_id, below_warning_enabled=new_setting)
 
     # Confirm the toggle
     await interaction.response.send_message(
         f"Below threshold warnings for alert **{alert_id}** are now **{'enabled' if new_setting else 'disabled'}**.", ephemeral=True
     )
 
+# Server list paging setup
+SERVERS_PER_PAGE = 10
+LIST_CACHE_SIZE = 128
+
+# Filtered listservers results, keyed by snapshot version and normalized query
+list_results_cache = OrderedDict()
+
+# Orderings offered by listservers; None keeps the API's order
+SERVER_SORTS = {
+    "players_desc": lambda servers: sorted(servers, key=lambda server: server.players, reverse=True),
+    "players_asc": lambda servers: sorted(servers, key=lambda server: server.players),
+    "name": lambda servers: sorted(servers, key=lambda server: server.name_key),
+    "api": None
+}
+
+# Function to filter (and sort) a snapshot for listservers, reusing earlier results for the same query
+def filter_servers(snapshot, players_required, name=None, map=None, region=None, gamemode=None, sort="api"):
+    name = name.lower() if name is not None else None
+    map = map.lower() if map is not None else None
+    region = region.lower() if region is not None else None
+    gamemode = gamemode.lower() if gamemode is not None else None
+    key = (snapshot.version, players_required, name, map, region, gamemode, sort)
+    results = list_results_cache.get(key)
+    if results is not None:
+        list_results_cache.move_to_end(key)
+        return results
+
+    # Filter servers based on the provided parameters
+    filtered_servers = []
+    for server in snapshot.servers:
+        if (server.players >= players_required and
+                (name is None or name in server.name_key) and
+                (map is None or map == server.map_key) and
+                (region is None or region == server.region_key) and
+                (gamemode is None or gamemode == server.gamemode_key)):
+            filtered_servers.append(server)
+    if SERVER_SORTS.get(sort):
+        filtered_servers = SERVER_SORTS[sort](filtered_servers)
+
+    results = tuple(filtered_servers)
+    list_results_cache[key] = results
+    if len(list_results_cache) > LIST_CACHE_SIZE:
+        list_results_cache.popitem(last=False)
+    return results
+
+# Function to render one page of listservers results
+def create_server_page_embed(servers, page):
+    pages = max(1, -(-len(servers) // SERVERS_PER_PAGE))
+    embed = discord.Embed(title="**Matching Servers**", color=discord.Color.blurple())
+    for server in servers[page * SERVERS_PER_PAGE:(page + 1) * SERVERS_PER_PAGE]:
+        embed.add_field(
+            name=server.name[:256],
+            value=(
+                f"Map: {server.map}\n"
+                f"Gamemode: {server.gamemode}\n"
+                f"Region: {server.region}\n"
+                f"Players: {server.players}/{server.max_players}"
+            ),
+            inline=False
+        )
+    embed.set_footer(text=f"Page {page + 1}/{pages} • {len(servers)} server(s)")
+    return embed
+
+# Prev/next buttons for listservers results; pages are cut from the cached result set
+class ServerListView(discord.ui.View):
+    def __init__(self, servers):
+        super().__init__(timeout=300)
+        self.servers = servers
+        self.page = 0
+        self.pages = max(1, -(-len(servers) // SERVERS_PER_PAGE))
+        self.update_buttons()
+
+    def update_buttons(self):
+        self.prev_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.pages - 1
+
+    async def show_page(self, interaction, page):
+        self.page = max(0, min(page, self.pages - 1))
+        self.update_buttons()
+        await interaction.response.edit_message(embed=create_server_page_embed(self.servers, self.page), view=self)
+
+    @discord.ui.button(label="◀ Prev", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_page(interaction, self.page - 1)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_page(interaction, self.page + 1)
+
 # Add the ListServers command under the BSM group
 @bsm_group.command(name="listservers", description="List all servers matching specific parameters.")
 @app_commands.describe(
@@ -308,40 +1220,35 @@ async def toggle_below_warning(interaction: discord.Interaction, alert_id: int):
     name="The server name to filter by (leave blank to ignore).",
     map="The map to filter by (leave blank to ignore).",
     region="The region to filter by (leave blank to ignore).",
-    gamemode="The gamemode to filter by (leave blank to ignore)."
+    gamemode="The gamemode to filter by (leave blank to ignore).",
+    sort="How to order the results (defaults to the server browser order)."
 )
-async def list_servers(interaction: discord.Interaction, players_required: int, name: str = None, map: str = None, region: str = None, gamemode: str = None):
-    # Fetch data from the API
-    response = requests.get("https://publicapi.battlebit.cloud/Servers/GetServerList")
-    servers = response.json()
+@app_commands.choices(sort=[
+    app_commands.Choice(name="Most players first", value="players_desc"),
+    app_commands.Choice(name="Fewest players first", value="players_asc"),
+    app_commands.Choice(name="Server name", value="name"),
+    app_commands.Choice(name="Server browser order", value="api")
+])
+@app_commands.autocomplete(name=autocomplete_server_name, map=autocomplete_map, region=autocomplete_region, gamemode=autocomplete_gamemode)
+async def list_servers(interaction: discord.Interaction, players_required: int, name: str = None, map: str = None, region: str = None, gamemode: str = None, sort: str = "api"):
+    # The upstream fetch can take longer than the 3 second interaction deadline
+    await interaction.response.defer(ephemeral=True)
 
-    # Filter servers based on the provided parameters
-    filtered_servers = []
-    for server in servers:
-        if (server["Players"] >= players_required and
-                (name is None or name.lower() in server["Name"].lower()) and
-                (map is None or map.lower() == server["Map"].lower()) and
-                (region is None or region.lower() == server["Region"].lower()) and
-                (gamemode is None or gamemode.lower() == server["Gamemode"].lower())):
-            filtered_servers.append(server)
+    # Read the shared snapshot (only hits the API when it is stale)
+    snapshot = await get_server_snapshot()
+    filtered_servers = filter_servers(snapshot, players_required, name, map, region, gamemode, sort)
 
     # Build the server list message
     if not filtered_servers:
-        await interaction.response.send_message("No servers match the specified criteria.", ephemeral=True)
+        await interaction.followup.send("No servers match the specified criteria.", ephemeral=True)
         return
 
-    server_message = "**Matching Servers:**\n"
-    for server in filtered_servers:
-        server_message += (
-            f"**Server:** {server['Name']}\n"
-            f"Map: {server['Map']}\n"
-            f"Gamemode: {server['Gamemode']}\n"
-            f"Region: {server['Region']}\n"
-            f"Players: {server['Players']}/{server['MaxPlayers']}\n\n"
-        )
-
-    # Send the results as an ephemeral message
-    await interaction.response.send_message(server_message, ephemeral=True)
+    # Send the first page as an ephemeral message, with buttons when there is more than one
+    embed = create_server_page_embed(filtered_servers, 0)
+    if len(filtered_servers) > SERVERS_PER_PAGE:
+        await interaction.followup.send(embed=embed, view=ServerListView(filtered_servers), ephemeral=True)
+    else:
+        await interaction.followup.send(embed=embed, ephemeral=True)
 
 # Add the Help command under the BSM group
 @bsm_group.command(name="help", description="Get help and instructions for using the bot.")
@@ -356,14 +1263,99 @@ async def help(interaction: discord.Interaction):
         "`/BSM DeleteAlert` - Delete an alert configuration.\n"
         "`/BSM ToggleBelowWarning` - Enable or disable alerts when player count drops below the threshold.\n"
         "`/BSM ListServers` - List all servers matching specific parameters.\n"
+        "`/BSM History` - Show the recent player count of a server or map.\n"
+        "`/BSM Stats` - Show monitor performance statistics (administrators only).\n"
         "`/BSM Help` - Get help and instructions for using the bot.\n\n"
         "**Example:**\n"
         "`/BSM Setup alert_name: Elite Soldiers min_players: 50 channel: #alerts ping_role: @Role`\n"
         "`/BSM Setup alert_map: Wakistan min_players: 100 channel: #alerts ping_role: @Role`\n\n"
-        "You can also combine both server name and map alerts in one command!\n\n"
+        "You can also combine both server name and map alerts in one command!\n"
+        "Pick `mode: Status board` to get one pinned message per channel that is kept up to date instead of a message per alert.\n\n"
         "If you need help, feel free to ask!"
     )
 
+# Add the History command under the BSM group
+@bsm_group.command(name="history", description="Show the recent player count of a server or map.")
+@app_commands.describe(
+    server="The server name to show (leave blank to use a map).",
+    map="The map to show, summed over all its servers (leave blank to use a server).",
+    hours="How far back to look, in hours (default 3, up to 30 days).",
+    region="The server's region, for a name used in more than one region (optional)."
+)
+@app_commands.autocomplete(server=autocomplete_server_name, map=autocomplete_map, region=autocomplete_region)
+async def history(interaction: discord.Interaction, server: str = None, map: str = None, hours: app_commands.Range[int, 1, 720] = 3,
+                  region: str = None):
+    if (server is None) == (map is None):
+        await interaction.response.send_message("Please give either a server or a map.", ephemeral=True)
+        return
+
+    kind = MATCH_NAME if server is not None else MATCH_MAP
+    target = player_history.find(kind, server if server is not None else map, region)
+    if target is None:
+        await interaction.response.send_message("No history recorded for that server or map yet.", ephemeral=True)
+        return
+
+    points = await player_history.load(kind, target, hours * 3600)
+    if kind == MATCH_NAME:
+        target_region, _, name = target.partition("/")
+        target = f"{name} ({target_region})"
+    if not points:
+        await interaction.response.send_message(f"No history recorded for **{target}** in the last {hours} hour(s).", ephemeral=True)
+        return
+
+    values = [players for _, players in points]
+    embed = discord.Embed(
+        title=f"📈 **{'Server' if kind == MATCH_NAME else 'Map'} History** 📈",
+        description=f"**{target}** • last {hours} hour(s)\n`{render_sparkline(points)}`",
+        color=discord.Color.blurple()
+    )
+    embed.add_field(name="Now", value=str(values[-1]), inline=True)
+    embed.add_field(name="Min", value=str(min(values)), inline=True)
+    embed.add_field(name="Max", value=str(max(values)), inline=True)
+    embed.add_field(name="Since", value=f"<t:{points[0][0]}:R>", inline=True)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Add the Stats command under the BSM group
+@bsm_group.command(name="stats", description="Show monitor performance statistics (administrators only).")
+@app_commands.checks.has_permissions(administrator=True)
+async def stats(interaction: discord.Interaction):
+    fetch = metrics.histogram("bsm_fetch_seconds")
+    payload = metrics.histogram("bsm_payload_bytes")
+    send = metrics.histogram("bsm_send_seconds")
+    uptime = int(time.time() - metrics.started)
+
+    embed = discord.Embed(title="📊 **BSM Stats**", color=discord.Color.blurple())
+    embed.add_field(name="Uptime", value=f"{uptime // 3600}h {uptime % 3600 // 60}m", inline=True)
+    embed.add_field(name="Guilds", value=str(len(bot.guilds)), inline=True)
+    embed.add_field(name="Alerts", value=str(len(config_store.by_id)), inline=True)
+    embed.add_field(name="Ticks", value=str(metrics.counter_value("bsm_ticks_total")), inline=True)
+    embed.add_field(name="Poll failures", value=str(metrics.counter_value("bsm_poll_failures_total")), inline=True)
+    embed.add_field(name="Not modified", value=str(metrics.counter_value("bsm_fetch_not_modified_total")), inline=True)
+    if fetch is not None:
+        embed.add_field(name="Fetch p50 / p95", value=f"≤{fetch.quantile(0.5) * 1000:.0f}ms / ≤{fetch.quantile(0.95) * 1000:.0f}ms", inline=True)
+    if payload is not None:
+        embed.add_field(name="Payload (avg)", value=f"{payload.sum / payload.count / 1024:.0f} KiB", inline=True)
+    if send is not None:
+        embed.add_field(name="Send p50 / p95", value=f"≤{send.quantile(0.5) * 1000:.0f}ms / ≤{send.quantile(0.95) * 1000:.0f}ms", inline=True)
+    embed.add_field(name="Config matches", value=str(metrics.counter_value("bsm_config_matches_total")), inline=True)
+    embed.add_field(name="Alerts triggered", value=str(metrics.counter_value("bsm_alerts_triggered_total")), inline=True)
+    embed.add_field(name="Messages sent", value=str(metrics.counter_value("bsm_messages_sent_total")), inline=True)
+    embed.add_field(name="Rate limit hits", value=str(metrics.counter_value("bsm_rate_limited_total")), inline=True)
+    embed.add_field(name="Send failures", value=str(metrics.counter_value("bsm_send_failures_total")), inline=True)
+    embed.add_field(name="Queue depth", value=str(dispatcher.depth), inline=True)
+    if last_tick_stats:
+        embed.add_field(
+            name="Last tick",
+            value=(
+                f"fetch {last_tick_stats['fetch'] * 1000:.0f}ms • parse {last_tick_stats['parse'] * 1000:.0f}ms • "
+                f"match {last_tick_stats['match'] * 1000:.0f}ms • dispatch {last_tick_stats['dispatch'] * 1000:.0f}ms\n"
+                f"{last_tick_stats['evaluated']} servers evaluated, {last_tick_stats['matches']} matches, "
+                f"{last_tick_stats['messages']} messages <t:{int(last_tick_stats['at'])}:R>"
+            ),
+            inline=False
+        )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 # Add the BSM group to the bot's command tree
 bot.tree.add_command(bsm_group)
 
@@ -378,120 +1370,981 @@ def create_alert_embed(title, description, color, fields):
         embed.add_field(name=name, value=value, inline=inline)
     return embed
 
+# Match kinds reported by the alert matcher
+MATCH_NAME = 0
+MATCH_MAP = 1
+
+# Alert state kind for rising alerts (tracked per server name)
+MATCH_RISING = 2
+
+# Aho-Corasick automaton for finding every alert_name inside a server name in one pass
+class NameAutomaton:
+    def __init__(self, patterns):
+        # patterns: {lowered pattern: payload}
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        for pattern, payload in patterns.items():
+            node = 0
+            for char in pattern:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                node = next_node
+            self.output[node] = self.output[node] + (payload,)
+
+        # Breadth-first pass to fill in failure links and inherited outputs
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    # Function to collect the payloads of every pattern occurring in text
+    def search(self, text):
+        found = []
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.extend(output[node])
+        return found
+
+# Matching engine for all alert configs, rebuilt whenever the configs change
+class AlertMatcher:
+    def __init__(self, configs):
+        self.configs = list(configs)
+        self.map_index = {}
+        name_patterns = {}
+        for index, config in enumerate(self.configs):
+            if config["alert_name"]:
+                name_patterns.setdefault(config["alert_name"].lower(), []).append(index)
+            if config["alert_map"]:
+                self.map_index.setdefault(config["alert_map"].lower(), []).append(index)
+        self.names = NameAutomaton({pattern: tuple(indexes) for pattern, indexes in name_patterns.items()})
+        self.has_names = bool(name_patterns)
+
+    # Function to find the (config, kind) pairs matching a server's lowercased name and map, in config table order.
+    # Same semantics as `alert_name.lower() in name.lower()` and `alert_map.lower() == map.lower()`
+    def match(self, name_key, map_key):
+        hits = set()
+        if self.has_names:
+            for indexes in self.names.search(name_key):
+                for index in indexes:
+                    hits.add((index, MATCH_NAME))
+        for index in self.map_index.get(map_key, ()):
+            hits.add((index, MATCH_MAP))
+        return [(self.configs[index], kind) for index, kind in sorted(hits)]
+
+# Outbound alert delivery setup
+MAX_EMBEDS_PER_MESSAGE = 10  # Discord's limit per message
+DISPATCH_CONCURRENCY = 8  # Channels being sent to at the same time
+DISPATCH_MAX_ATTEMPTS = 5
+DISPATCH_MAX_BACKOFF = 60
+
+# Function to add a triggered alert to this tick's per-channel outbox (embed None queues just the ping)
+def queue_alert(outbox, channel, ping_role_id, embed):
+    entry = outbox.get(channel.id)
+    if entry is None:
+        entry = outbox[channel.id] = (channel, [], [])
+    if ping_role_id and ping_role_id not in entry[1]:
+        entry[1].append(ping_role_id)
+    if embed is not None:
+        entry[2].append(embed)
+
+# Function to combine a channel's alerts into as few messages as possible:
+# the role pings go on the first message, embeds are packed 10 per message
+def build_alert_messages(pings, embeds):
+    content = " ".join(f"<@&{role_id}>" for role_id in pings) or None
+    messages = []
+    for start in range(0, len(embeds), MAX_EMBEDS_PER_MESSAGE):
+        messages.append((content if start == 0 else None, embeds[start:start + MAX_EMBEDS_PER_MESSAGE]))
+    if not messages and content:
+        messages.append((content, []))
+    return messages
+
+# Per-channel outbound queues drained by concurrent workers.
+# Sends to one channel stay in order; a slow or rate limited channel only delays itself.
+class AlertDispatcher:
+    def __init__(self, concurrency=DISPATCH_CONCURRENCY):
+        self.queues = {}  # Format: {channel_id: deque of (content, embeds)}
+        self.edits = {}  # Format: {channel_id: coroutine function}, only the newest status board update is kept
+        self.workers = {}  # Format: {channel_id: task draining that queue}
+        self.backoff_until = {}  # Format: {channel_id: monotonic time}, the message route bucket is per channel
+        self.slots = asyncio.Semaphore(concurrency)
+        self.depth = 0
+
+    # Function to queue a channel's alerts for this tick
+    def submit(self, channel, pings, embeds):
+        queue = self.queues.setdefault(channel.id, deque())
+        messages = build_alert_messages(pings, embeds)
+        queue.extend(messages)
+        self.depth += len(messages)
+        self._start(channel)
+        return len(messages)
+
+    # Function to queue a status board update, replacing one that has not gone out yet.
+    # It is sent after the channel's queued messages.
+    def submit_edit(self, channel, publish):
+        self.queues.setdefault(channel.id, deque())
+        if channel.id not in self.edits:
+            self.depth += 1
+        self.edits[channel.id] = publish
+        self._start(channel)
+
+    def _start(self, channel):
+        worker = self.workers.get(channel.id)
+        if worker is None or worker.done():
+            self.workers[channel.id] = asyncio.ensure_future(self._drain(channel))
+
+    async def _drain(self, channel):
+        queue = self.queues[channel.id]
+        try:
+            while queue or channel.id in self.edits:
+                edit = self.edits.pop(channel.id) if not queue else None
+                if edit is None:
+                    content, embeds = queue[0]
+                    action = functools.partial(channel.send, content=content, embeds=embeds)
+                else:
+                    action = edit
+                try:
+                    await self._send(channel, action)
+                except Exception:
+                    logger.exception("Error sending alert to channel %s", channel.id)
+                    metrics.inc("bsm_send_failures_total")
+                if edit is None:
+                    queue.popleft()
+                self.depth -= 1
+        finally:
+            if not queue and channel.id not in self.edits:
+                self.queues.pop(channel.id, None)
+                self.workers.pop(channel.id, None)
+                if self.backoff_until.get(channel.id, 0) <= time.monotonic():
+                    self.backoff_until.pop(channel.id, None)
+
+    async def _send(self, channel, action):
+        for attempt in range(DISPATCH_MAX_ATTEMPTS):
+            wait = self.backoff_until.get(channel.id, 0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            async with self.slots:
+                started = time.monotonic()
+                try:
+                    await action()
+                except discord.RateLimited as e:
+                    metrics.inc("bsm_rate_limited_total")
+                    delay = e.retry_after
+                except discord.HTTPException as e:
+                    if e.status != 429 and e.status < 500:
+                        # Missing access, unknown channel, invalid body: retrying will not help
+                        logger.warning("Dropping alert for channel %s: %s", channel.id, e)
+                        metrics.inc("bsm_send_failures_total")
+                        return False
+                    if e.status == 429:
+                        metrics.inc("bsm_rate_limited_total")
+                    delay = min(DISPATCH_MAX_BACKOFF, 2 ** attempt)
+                else:
+                    metrics.observe("bsm_send_seconds", time.monotonic() - started)
+                    metrics.inc("bsm_messages_sent_total")
+                    return True
+            self.backoff_until[channel.id] = time.monotonic() + delay + random.uniform(0, 1)
+        logger.warning("Giving up on alert for channel %s after %d attempts", channel.id, DISPATCH_MAX_ATTEMPTS)
+        metrics.inc("bsm_send_failures_total")
+        return False
+
+    # Function to wait until everything queued so far has been sent
+    async def join(self):
+        while self.workers:
+            await asyncio.gather(*list(self.workers.values()), return_exceptions=True)
+
+dispatcher = AlertDispatcher()
+metrics.gauge("bsm_dispatch_queue_depth", lambda: dispatcher.depth)
+
+# Status board setup
+BOARD_SERVERS_PER_ALERT = 10
+BOARD_MAX_FIELDS = 25  # Discord's limit per embed
+BOARD_MAX_LENGTH = 5500  # Discord caps an embed at 6000 characters
+BOARD_EDIT_INTERVAL = 120  # Minimum seconds between edits of one board, changes in between are folded into the next edit
+
+# Servers shown on each channel's status board, kept up to date from the servers each tick evaluates
+class StatusBoards:
+    def __init__(self):
+        self.rows = {}  # Format: {channel_id: {(alert_id, kind, region, server name): (server, target)}}
+        self.counts = {}  # Format: {(alert_id, kind, target): servers shown}
+        self.dirty = set()  # Channels whose board has to be rendered again
+        self.emptied = set()  # (alert_id, kind, target) keys that lost their last server this tick
+        self.queued = {}  # Format: {channel_id: content hash of the last board handed to the dispatcher}
+        self.next_edit = {}  # Format: {channel_id: monotonic time the board may be edited again}
+
+    # Function to take the rows of edited or deleted alerts off every board.
+    # Rows of the other alerts (and with them, who is inside the clear_players band) carry over.
+    def forget_alerts(self, alert_ids):
+        if not alert_ids:
+            return
+        for channel_id, rows in self.rows.items():
+            for key in [key for key in rows if key[0] in alert_ids]:
+                server, target = rows.pop(key)
+                self._count((key[0], key[1], target), -1)
+                self.dirty.add(channel_id)
+
+    def _count(self, key, delta):
+        count = self.counts.get(key, 0) + delta
+        if count > 0:
+            self.counts[key] = count
+        else:
+            self.counts.pop(key, None)
+            self.emptied.add(key)
+
+    # Function to show or hide a server on a board.
+    # Returns whether the alert's target (server or map) has any server shown.
+    def update(self, channel_id, alert_id, kind, target, server, shown):
+        rows = self.rows.setdefault(channel_id, {})
+        key = (alert_id, kind, server.region, server.name)
+        previous = rows.pop(key, None)
+        if previous is not None:
+            self._count((alert_id, kind, previous[1]), -1)
+        if shown:
+            rows[key] = (server, target)
+            self._count((alert_id, kind, target), 1)
+        if (previous is not None) != shown or (shown and previous[0] is not server):
+            self.dirty.add(channel_id)
+        return (alert_id, kind, target) in self.counts
+
+    def is_shown(self, channel_id, alert_id, kind, server):
+        return (alert_id, kind, server.region, server.name) in self.rows.get(channel_id, ())
+
+    # Function to take servers that are no longer listed off every board
+    def remove_servers(self, gone):
+        for channel_id, rows in self.rows.items():
+            for key in [key for key in rows if key[2:] in gone]:
+                server, target = rows.pop(key)
+                self._count((key[0], key[1], target), -1)
+                self.dirty.add(channel_id)
+
+# Function to describe a board alert in its field title
+def describe_board_alert(config):
+    watching = " · ".join(part for part in (config["alert_name"], config["alert_map"]) if part)
+    if config["alert_type"] == ALERT_RISING:
+        condition = f"+{config['rise_players'] or RISE_PLAYERS_DEFAULT} in {config['rise_minutes'] or RISE_MINUTES_DEFAULT} min"
+    else:
+        condition = f"{config['min_players'] or 0}+ players"
+    return f"#{config['alert_id']} {watching} ({condition})"[:256]
+
+# Function to render a channel's status board.
+# Returns the embed and a hash of its content, which leaves out the timestamp so an unchanged board hashes the same.
+def render_board(configs, rows):
+    embed = discord.Embed(title="📋 **Server Board**", color=discord.Color.blue())
+    by_alert = {}
+    for (alert_id, _, region, name), (server, _) in rows.items():
+        by_alert.setdefault(alert_id, {})[(region, name)] = server
+    length = len(embed.title)
+    hidden = 0
+    for config in configs:
+        servers = sorted(by_alert.get(config["alert_id"], {}).values(), key=lambda server: (-server.players, server.name))
+        lines = [f"`{server.players:>3}/{server.max_players}` {server.name[:60]} · {server.map}" for server in servers[:BOARD_SERVERS_PER_ALERT]]
+        if len(servers) > BOARD_SERVERS_PER_ALERT:
+            lines.append(f"...and {len(servers) - BOARD_SERVERS_PER_ALERT} more")
+        name = describe_board_alert(config)
+        value = "\n".join(lines) or "No servers right now."
+        if len(embed.fields) >= BOARD_MAX_FIELDS or length + len(name) + len(value) > BOARD_MAX_LENGTH:
+            hidden += 1
+            continue
+        embed.add_field(name=name, value=value, inline=False)
+        length += len(name) + len(value)
+    if not configs:
+        embed.description = "No status board alerts use this channel any more."
+    if hidden:
+        embed.set_footer(text=f"{hidden} more alert(s) not shown")
+    content_hash = hashlib.sha1(json.dumps(embed.to_dict(), sort_keys=True).encode()).hexdigest()
+    embed.timestamp = datetime.now(timezone.utc)
+    return embed, content_hash
+
+# Function to publish a status board: edit the channel's board message, or post and pin a new one
+async def publish_board(channel, embed, content_hash):
+    message_id = board_store.get(channel.id)[0]
+    if message_id is not None:
+        try:
+            await channel.get_partial_message(message_id).edit(embed=embed)
+            metrics.inc("bsm_board_edits_total")
+            await board_store.save(channel.id, message_id, content_hash)
+            return
+        except discord.NotFound:
+            logger.info("Status board in channel %s was deleted, posting a new one", channel.id)
+    message = await channel.send(embed=embed)
+    await board_store.save(channel.id, message.id, content_hash)
+    try:
+        await message.pin()
+    except discord.HTTPException as e:
+        logger.warning("Could not pin the status board in channel %s: %s", channel.id, e)
+
+# Resolved Discord channels for alert configs, so the monitor does not look them up per match.
+# Entries are dropped by the channel/guild delete events below.
+class TargetCache:
+    def __init__(self, client):
+        self.client = client
+        self.channels = {}  # Format: {channel_id: channel}
+
+    def get_channel(self, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.client.get_channel(channel_id)
+            if channel is not None:
+                self.channels[channel_id] = channel
+        return channel
+
+    def invalidate_channel(self, channel_id):
+        self.channels.pop(channel_id, None)
+
+    def invalidate_guild(self, guild_id):
+        for channel_id, channel in list(self.channels.items()):
+            if channel.guild.id == guild_id:
+                del self.channels[channel_id]
+
+target_cache = TargetCache(bot)
+
+# How often every config is checked for channels/guilds that no longer exist
+DEAD_ALERT_SWEEP_INTERVAL = 3600
+
+# Function to post a notice in a guild's system channel (or the first channel the bot can write to)
+async def notify_guild(guild, message):
+    channel = guild.system_channel
+    if channel is None or not channel.permissions_for(guild.me).send_messages:
+        channel = next((c for c in guild.text_channels if c.permissions_for(guild.me).send_messages), None)
+    if channel is None:
+        return
+    try:
+        await channel.send(message)
+    except discord.HTTPException as e:
+        logger.warning("Could not notify guild %s: %s", guild.id, e)
+
+# Function to delete alerts whose target is gone for good, telling the guild which ones went
+async def prune_alerts(configs, reason, guild=None):
+    if not configs:
+        return
+    for config in configs:
+        await config_store.delete(config["alert_id"])
+    metrics.inc("bsm_alerts_pruned_total", len(configs))
+    alert_ids = ", ".join(f"**{config['alert_id']}**" for config in configs)
+    logger.info("Pruned alert(s) %s: %s", alert_ids, reason)
+    if guild is not None:
+        await notify_guild(guild, f"🗑️ Removed BSM alert(s) {alert_ids} because {reason}.")
+
+# Function to find alerts whose guild or channel no longer exists (e.g. deleted while the bot was offline)
+async def prune_dead_alerts():
+    for guild_id, configs in list(config_store.by_guild.items()):
+        guild = bot.get_guild(int(guild_id))
+        if guild is None:
+            # Not in the guild any more (an unavailable guild is still returned by get_guild)
+            await prune_alerts(list(configs.values()), "the bot is no longer in that server")
+            continue
+        if guild.unavailable:
+            continue
+        dead = [config for config in configs.values() if config["channel_id"] and guild.get_channel(config["channel_id"]) is None]
+        await prune_alerts(dead, "their alert channel no longer exists", guild)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    target_cache.invalidate_channel(channel.id)
+    await board_store.forget(channel.id)
+    dead = [config for config in config_store.for_guild(str(channel.guild.id)) if config["channel_id"] == channel.id]
+    await prune_alerts(dead, f"their alert channel #{channel.name} was deleted", channel.guild)
+
+@bot.event
+async def on_guild_remove(guild):
+    target_cache.invalidate_guild(guild.id)
+    await prune_alerts(config_store.for_guild(str(guild.id)), "the bot was removed from that server")
+
+@bot.event
+async def on_guild_role_delete(role):
+    # The alert still works without a ping, so only the role is dropped
+    affected = [config for config in config_store.for_guild(str(role.guild.id)) if config["ping_role_id"] == role.id]
+    for config in affected:
+        await config_store.update(config["alert_id"], clear=("ping_role_id",))
+    if affected:
+        alert_ids = ", ".join(f"**{config['alert_id']}**" for config in affected)
+        await notify_guild(role.guild, f"ℹ️ BSM alert(s) {alert_ids} will no longer ping **@{role.name}** because the role was deleted.")
+
+# Fields whose change makes a server worth re-evaluating against the alerts
+DELTA_FIELDS = ("players", "map", "name")
+
+# Function to key a server list by server identity (region + name).
+# Servers sharing both get an occurrence number so none of them is dropped.
+def index_servers(servers):
+    index = {}
+    for server in servers:
+        key = (server.region, server.name, 0)
+        while key in index:
+            key = (key[0], key[1], key[2] + 1)
+        index[key] = server
+    return index
+
+# Function to diff two indexed server lists.
+# Returns (servers that appeared or changed, in list order; servers that disappeared)
+def diff_servers(previous_index, current_index):
+    changed = []
+    for key, server in current_index.items():
+        old = previous_index.get(key)
+        if old is None or (old is not server and any(getattr(old, field) != getattr(server, field) for field in DELTA_FIELDS)):
+            changed.append(server)
+    removed = [server for key, server in previous_index.items() if key not in current_index]
+    return changed, removed
+
+# Function to forget alert state for servers (and maps) that are no longer listed
+def clear_vanished_servers(removed, current_index):
+    if not removed:
+        return
+    gone_names = {server.name for server in removed} - {server.name for server in current_index.values()}
+    gone_maps = {server.map for server in removed} - {server.map for server in current_index.values()}
+    alert_state_store.forget_targets(MATCH_NAME, gone_names)
+    alert_state_store.forget_targets(MATCH_RISING, gone_names)
+    alert_state_store.forget_targets(MATCH_MAP, gone_maps)
+
+# Poll scheduling setup
+POLL_INTERVAL = 60  # Seconds between polls at peak hours
+POLL_INTERVAL_MIN = 30  # Used while a watched server is close to an alert threshold
+POLL_INTERVAL_MAX = 120  # Used off-peak when nothing watched is close to a threshold
+PEAK_HOURS_UTC = range(16, 24)
+NEAR_THRESHOLD_RATIO = 0.8  # A server at 80% or more of min_players (but below it) counts as close
+POLL_BACKOFF_MAX = 600
+
+# Ticks on a fixed grid of loop-clock deadlines, so fetch and dispatch time do not
+# stretch the period. Overrunning ticks skip the missed deadlines instead of bunching up,
+# and failures back off exponentially (with jitter) until a poll succeeds again.
+class PollScheduler:
+    def __init__(self, interval=POLL_INTERVAL, min_interval=POLL_INTERVAL_MIN, max_interval=POLL_INTERVAL_MAX, peak_hours=PEAK_HOURS_UTC):
+        self.interval = interval
+        self.base_interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.peak_hours = peak_hours
+        self.failures = 0
+        self.skipped = 0
+        self.next_tick = None
+
+    # Function to pick the interval for the next tick
+    def choose_interval(self, near_threshold):
+        if near_threshold:
+            return self.min_interval
+        if datetime.now(timezone.utc).hour in self.peak_hours:
+            return self.base_interval
+        return self.max_interval
+
+    # Function to schedule the next tick after a successful poll
+    def succeeded(self, near_threshold=False):
+        now = asyncio.get_running_loop().time()
+        self.failures = 0
+        self.interval = self.choose_interval(near_threshold)
+        if self.next_tick is None:
+            self.next_tick = now
+        self.next_tick += self.interval
+        while self.next_tick <= now:
+            self.next_tick += self.interval
+            self.skipped += 1
+
+    # Function to schedule a retry after a failed poll
+    def failed(self):
+        now = asyncio.get_running_loop().time()
+        self.failures += 1
+        ceiling = min(POLL_BACKOFF_MAX, self.interval * 2 ** (self.failures - 1))
+        delay = random.uniform(ceiling / 2, ceiling)
+        self.next_tick = now + delay
+        return delay
+
+    # Function to sleep until the next scheduled tick
+    async def wait(self):
+        delay = self.next_tick - asyncio.get_running_loop().time() if self.next_tick is not None else 0
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+# State the monitor carries from one tick to the next
+class MonitorState:
+    def __init__(self, get_channel, dispatcher):
+        self.get_channel = get_channel
+        self.dispatcher = dispatcher
+        self.matcher = None
+        self.matcher_version = None
+        self.configs = {}  # Format: {alert_id: config} as of the last matcher rebuild
+        self.server_index = {}
+        self.snapshot_version = None
+        self.near_threshold = set()  # Names of watched servers just below an alert threshold
+        self.boards = StatusBoards()
+        self.board_configs = {}  # Format: {channel_id: [board mode configs posting there]}
+        self.servers_by_map = {}  # Format: {lowercased map: [servers on it]}
+        self.tick = 0
+        self.pending = {}  # Format: {(alert_id, kind, target): (wanted state, first tick, last tick, (region, server name))}
+
+    # Function to debounce a state change; returns True once it has been wanted for sustain_ticks ticks in a row
+    def sustained(self, key, wanted, sustain_ticks, server):
+        pending = self.pending.get(key)
+        first_tick = pending[1] if pending is not None and pending[0] == wanted else self.tick
+        if self.tick - first_tick + 1 >= sustain_ticks:
+            self.pending.pop(key, None)
+            return True
+        self.pending[key] = (wanted, first_tick, self.tick, (server.region, server.name))
+        return False
+
+    # Function to drop pending changes that were not wanted again this tick (the count went back, or the server left)
+    def expire_pending(self):
+        for key in [key for key, pending in self.pending.items() if pending[2] != self.tick]:
+            del self.pending[key]
+
+# Function to find the busiest server on a server's map.
+# Map alerts follow it, so every server on the map wants the same state for the alert.
+def busiest_on_map(state, server):
+    return max(state.servers_by_map.get(server.map_key, (server,)), key=lambda other: other.players)
+
+# Function to decide whether a threshold alert switches on or off for a server (for map alerts,
+# the busiest server on the map), applying the alert's hysteresis band (fire at min_players,
+# clear below clear_players) and sustain time. An alert clears whether or not its below warning is
+# enabled, so it can fire again; the flag only decides whether the clear is announced.
+# Returns the new state, or None if the alert stays as it is for now.
+def threshold_transition(state, config, kind, target, server):
+    key = (config["alert_id"], kind, target)
+    active = alert_state_store.is_active(*key)
+    min_players = config["min_players"] or 0
+    clear_players = config["clear_players"] if config["clear_players"] is not None else min_players
+    if server.players >= min_players:
+        wanted = True
+    elif server.players < clear_players:
+        wanted = False
+    else:
+        wanted = active
+    if wanted == active:
+        state.pending.pop(key, None)
+        return None
+    return wanted if state.sustained(key, wanted, config["sustain_ticks"] or 1, server) else None
+
+# Function to run one monitor pass.
+# Returns per-stage timings (seconds), payload size, servers evaluated and messages queued.
+async def run_monitor_tick(state):
+    # Always take a fresh snapshot, joining any refresh already in flight
+    snapshot = await get_server_snapshot(max_age=0)
+    state.tick += 1
+    stats = {"fetch": fetch_stats["fetch"], "parse": fetch_stats["parse"], "bytes": fetch_stats["bytes"]}
+    started = time.perf_counter()
+
+    # Sample every server's player count for /bsm history and rising alerts
+    player_history.record(snapshot.servers)
+
+    # Rebuild the matcher only when the in-memory configs changed.
+    # Added or edited alerts have never seen the current list, so every server is checked against just those.
+    first_pass = state.matcher is None
+    fresh_matcher = None
+    if first_pass or config_store.version != state.matcher_version:
+        configs = config_store.all()
+        previous_configs, state.configs = state.configs, {config["alert_id"]: config for config in configs}
+        state.matcher = AlertMatcher(configs)
+        state.matcher_version = config_store.version
+        if not first_pass:
+            # Config dicts are replaced on every edit, so identity tells which alerts changed
+            fresh_matcher = AlertMatcher([config for config in configs if previous_configs.get(config["alert_id"]) is not config])
+            alert_state_store.forget_alerts(set(previous_configs) - set(state.configs))
+
+        previous = {config["alert_id"]: config for configs in state.board_configs.values() for config in configs}
+        state.board_configs = {}
+        for config in config_store.all():
+            if config["mode"] == MODE_BOARD and config["channel_id"]:
+                state.board_configs.setdefault(config["channel_id"], []).append(config)
+        current = {config["alert_id"]: config for configs in state.board_configs.values() for config in configs}
+
+        stale = {alert_id for alert_id, config in previous.items() if current.get(alert_id) is not config}
+        state.boards.forget_alerts(stale)
+        state.boards.dirty.update(config["channel_id"] for config in previous.values() if config["alert_id"] in stale)
+        state.boards.dirty.update(config["channel_id"] for config in current.values() if previous.get(config["alert_id"]) is not config)
+
+    # Only servers that appeared or changed since the last tick need evaluating
+    if snapshot.version != state.snapshot_version:
+        current_index = index_servers(snapshot.servers)
+        changed, removed = diff_servers(state.server_index, current_index)
+        clear_vanished_servers(removed, current_index)
+        if removed:
+            state.boards.remove_servers({(server.region, server.name) for server in removed} - {key[:2] for key in current_index})
+        state.near_threshold.difference_update(server.name for server in removed)
+        state.server_index = current_index
+        state.servers_by_map = {}
+        for server in snapshot.servers:
+            state.servers_by_map.setdefault(server.map_key, []).append(server)
+        state.snapshot_version = snapshot.version
+    else:
+        changed = []
+    servers = changed
+
+    # Servers with a state change waiting out its sustain time are evaluated every tick, changed or not
+    if state.pending:
+        waiting = {pending[3] for pending in state.pending.values()} - {(server.region, server.name) for server in changed}
+        servers = changed + [server for key, server in state.server_index.items() if key[:2] in waiting]
+
+    # Every server is checked against all alerts if it needs evaluating anyway, otherwise only against added or edited alerts
+    evaluations = [(server, state.matcher) for server in servers]
+    if fresh_matcher is not None:
+        evaluated = {id(server) for server in servers}
+        evaluations.extend((server, fresh_matcher) for server in snapshot.servers if id(server) not in evaluated)
+
+    # Drop state for alerts and targets that vanished while the bot was down
+    if first_pass:
+        live_names = {server.name for server in snapshot.servers}
+        alert_state_store.prune(set(config_store.by_id), {
+            MATCH_NAME: live_names,
+            MATCH_MAP: {server.map for server in snapshot.servers},
+            MATCH_RISING: live_names
+        })
+
+    # Alerts triggered this tick, grouped per channel
+    outbox = {}
+    matches = 0
+
+    # Check each server that needs evaluating
+    for server, matcher in evaluations:
+        near = False
+        peak = None
+
+        # Only visit the configs whose name or map actually matches this server
+        for config, kind in matcher.match(server.name_key, server.map_key):
+            matches += 1
+            alert_id = config["alert_id"]
+            min_players = config["min_players"]
+            ping_role_id = config["ping_role_id"]
+            if min_players and min_players * NEAR_THRESHOLD_RATIO <= server.players < min_players:
+                near = True
+            channel = state.get_channel(config["channel_id"]) if config["channel_id"] else None
+            if not channel:
+                continue
+
+            if config["alert_type"] == ALERT_RISING:
+                gain = player_history.gain(server, (config["rise_minutes"] or RISE_MINUTES_DEFAULT) * 60)
+                rising = gain >= (config["rise_players"] or RISE_PLAYERS_DEFAULT) and server.players >= (min_players or 0)
+
+            # Board alerts only update the channel's status board, and ping when the alert turns on
+            if config["mode"] == MODE_BOARD:
+                if config["alert_type"] == ALERT_RISING:
+                    kind, shown = MATCH_RISING, rising
+                else:
+                    # Once shown, a server stays on the board until it drops below clear_players
+                    clear_players = config["clear_players"] if config["clear_players"] is not None else (min_players or 0)
+                    shown = server.players >= (min_players or 0) or (
+                        server.players >= clear_players and state.boards.is_shown(channel.id, alert_id, kind, server)
+                    )
+                target = server.map if kind == MATCH_MAP else server.name
+                active = state.boards.update(channel.id, alert_id, kind, target, server, shown)
+                if active and ping_role_id and not alert_state_store.is_active(alert_id, kind, target):
+                    queue_alert(outbox, channel, ping_role_id, None)
+                alert_state_store.set(alert_id, kind, target, active)
+                continue
+
+            # Check rising alerts
+            if config["alert_type"] == ALERT_RISING:
+                if rising and not alert_state_store.is_active(alert_id, MATCH_RISING, server.name):
+                    embed = create_alert_embed(
+                        title="📈 **Rising Fast** 📈",
+                        description=f"**Server:** {server.name} gained **{gain}** players in the last {config['rise_minutes'] or RISE_MINUTES_DEFAULT} minutes.",
+                        color=discord.Color.orange(),
+                        fields=[
+                            ("Map", server.map, True),
+                            ("Gamemode", server.gamemode, True),
+                            ("Players", f"{server.players}/{server.max_players}", True),
+                            ("Region", server.region, True)
+                        ]
+                    )
+                    queue_alert(outbox, channel, ping_role_id, embed)
+                alert_state_store.set(alert_id, MATCH_RISING, server.name, rising)
+                continue
+
+            # Check server name alerts
+            if kind == MATCH_NAME:
+                transition = threshold_transition(state, config, MATCH_NAME, server.name, server)
+                if transition is True:
+                    embed = create_alert_embed(
+                        title="🚨 **Server Alert** 🚨",
+                        description=f"**Server:** {server.name}",
+                        color=discord.Color.green(),
+                        fields=[
+                            ("Map", server.map, True),
+                            ("Gamemode", server.gamemode, True),
+                            ("Players", f"{server.players}/{server.max_players}", True),
+                            ("Region", server.region, True)
+                        ]
+                    )
+                    queue_alert(outbox, channel, ping_role_id, embed)
+                    alert_state_store.set(alert_id, MATCH_NAME, server.name, True)
+                elif transition is False:
+                    if config["below_warning_enabled"]:
+                        embed = create_alert_embed(
+                            title="🔴 **Server Alert** 🔴",
+                            description=f"**Server:** {server.name} is now below the minimum player count.",
+                            color=discord.Color.red(),
+                            fields=[
+                                ("Players", f"{server.players}/{server.max_players}", False)
+                            ]
+                        )
+                        queue_alert(outbox, channel, ping_role_id, embed)
+                    alert_state_store.set(alert_id, MATCH_NAME, server.name, False)
+
+            # Check map alerts
+            if kind == MATCH_MAP:
+                if peak is None:
+                    peak = busiest_on_map(state, server)
+                transition = threshold_transition(state, config, MATCH_MAP, server.map, peak)
+                if transition is True:
+                    embed = create_alert_embed(
+                        title="🚨 **Map Alert** 🚨",
+                        description=f"**Map:** {server.map}",
+                        color=discord.Color.green(),
+                        fields=[
+                            ("Server", f"{peak.name}", True),
+                            ("Gamemode", peak.gamemode, True),
+                            ("Players", f"{peak.players}/{peak.max_players}", True),
+                            ("Region", peak.region, True)
+                        ]
+                    )
+                    queue_alert(outbox, channel, ping_role_id, embed)
+                    alert_state_store.set(alert_id, MATCH_MAP, server.map, True)
+                elif transition is False:
+                    if config["below_warning_enabled"]:
+                        embed = create_alert_embed(
+                            title="🔴 **Map Alert** 🔴",
+                            description=f"**Map:** {server.map} is now below the minimum player count.",
+                            color=discord.Color.red(),
+                            fields=[
+                                ("Server", f"{peak.name}", False),
+                                ("Players", f"{peak.players}/{peak.max_players}", False)
+                            ]
+                        )
+                        queue_alert(outbox, channel, ping_role_id, embed)
+                    alert_state_store.set(alert_id, MATCH_MAP, server.map, False)
+
+        if near:
+            state.near_threshold.add(server.name)
+        elif matcher is state.matcher:
+            state.near_threshold.discard(server.name)
+
+    state.expire_pending()
+
+    stats["evaluated"] = len(evaluations)
+    stats["matches"] = matches
+    stats["alerts"] = sum(len(embeds) for _, _, embeds in outbox.values())
+    stats["near_threshold"] = len(state.near_threshold)
+    stats["match"] = time.perf_counter() - started
+
+    # Board targets that lost their last server are off again
+    for key in state.boards.emptied:
+        if key not in state.boards.counts:
+            alert_state_store.set(*key, False)
+    state.boards.emptied.clear()
+
+    # Hand everything to the dispatcher, which sends per channel in the background
+    started = time.perf_counter()
+    stats["messages"] = 0
+    for channel, pings, embeds in outbox.values():
+        stats["messages"] += state.dispatcher.submit(channel, pings, embeds)
+
+    # Re-render the boards whose servers changed; a board whose content is unchanged is not edited,
+    # and one edited recently stays dirty until its interval is up
+    stats["board_updates"] = 0
+    now = time.monotonic()
+    for channel_id in list(state.boards.dirty):
+        if state.boards.next_edit.get(channel_id, 0) > now:
+            continue
+        state.boards.dirty.discard(channel_id)
+        channel = state.get_channel(channel_id)
+        if channel is None:
+            continue
+        embed, content_hash = render_board(state.board_configs.get(channel_id, []), state.boards.rows.get(channel_id, {}))
+        if content_hash == state.boards.queued.get(channel_id, board_store.get(channel_id)[1]):
+            continue
+        state.boards.queued[channel_id] = content_hash
+        state.boards.next_edit[channel_id] = now + BOARD_EDIT_INTERVAL
+        state.dispatcher.submit_edit(channel, functools.partial(publish_board, channel, embed, content_hash))
+        stats["board_updates"] += 1
+    stats["dispatch"] = time.perf_counter() - started
+    record_tick(stats)
+
+    # Persist the state changes and history rollups made this tick
+    await alert_state_store.checkpoint()
+    await player_history.flush()
+    return stats
+
+# Most recent tick's stats, shown by /bsm stats
+last_tick_stats = {}
+
+# Function to feed one tick's stats into the metrics
+def record_tick(stats):
+    if stats["bytes"]:
+        metrics.observe("bsm_fetch_seconds", stats["fetch"])
+        metrics.observe("bsm_parse_seconds", stats["parse"])
+        metrics.observe("bsm_payload_bytes", stats["bytes"], buckets=BYTES_BUCKETS)
+    else:
+        metrics.inc("bsm_fetch_not_modified_total")
+    metrics.observe("bsm_match_seconds", stats["match"])
+    metrics.observe("bsm_dispatch_seconds", stats["dispatch"])
+    metrics.inc("bsm_ticks_total")
+    metrics.inc("bsm_servers_evaluated_total", stats["evaluated"])
+    metrics.inc("bsm_config_matches_total", stats["matches"])
+    metrics.inc("bsm_alerts_triggered_total", stats["alerts"])
+    metrics.inc("bsm_messages_queued_total", stats["messages"])
+    metrics.inc("bsm_board_updates_queued_total", stats["board_updates"])
+    last_tick_stats.clear()
+    last_tick_stats.update(stats, at=time.time())
+    logger.debug("Tick: %s", stats)
+
 # Function to monitor the API
 async def monitor_api():
     await bot.wait_until_ready()
+    state = MonitorState(target_cache.get_channel, dispatcher)
+    scheduler = PollScheduler()
+    metrics.gauge("bsm_poll_interval_seconds", lambda: scheduler.interval)
+    metrics.gauge("bsm_ticks_skipped", lambda: scheduler.skipped)
+
+    last_sweep = None
 
     while not bot.is_closed():
+        # Drop alerts pointing at deleted channels or guilds the bot left
+        if last_sweep is None or time.monotonic() - last_sweep >= DEAD_ALERT_SWEEP_INTERVAL:
+            last_sweep = time.monotonic()
+            try:
+                await prune_dead_alerts()
+            except Exception:
+                logger.exception("Error pruning dead alerts")
+
         try:
-            # Fetch data from the API
-            response = requests.get("https://publicapi.battlebit.cloud/Servers/GetServerList")
-            servers = response.json()
-
-            # Load all configurations
-            conn = sqlite3.connect(DATABASE_FILE)
-            c = conn.cursor()
-            c.execute('''SELECT alert_id, alert_name, alert_map, min_players, channel_id, ping_role_id, below_warning_enabled FROM configs''')
-            configs = c.fetchall()
-            conn.close()
-
-            # Check each server in the API response
-            for server in servers:
-                # Iterate through all guild configurations
-                for config in configs:
-                    alert_id, alert_name, alert_map, min_players, channel_id, ping_role_id, below_warning_enabled = config
-                    channel = bot.get_channel(int(channel_id))
-                    if not channel:
-                        continue
-
-                    # Initialize alert states for this guild if not already done
-                    if alert_id not in alert_states:
-                        alert_states[alert_id] = {
-                            "server_alerts": {},
-                            "map_alerts": {}
-                        }
-
-                    # Check server name alerts
-                    if alert_name and alert_name.lower() in server["Name"].lower():
-                        if server["Players"] >= min_players:
-                            if not alert_states[alert_id]["server_alerts"].get(server["Name"], False):
-                                # Ping the role if specified
-                                if ping_role_id:
-                                    await channel.send(f"<@&{ping_role_id}>")
-
-                                embed = create_alert_embed(
-                                    title="🚨 **Server Alert** 🚨",
-                                    description=f"**Server:** {server['Name']}",
-                                    color=discord.Color.green(),
-                                    fields=[
-                                        ("Map", server["Map"], True),
-                                        ("Gamemode", server["Gamemode"], True),
-                                        ("Players", f"{server['Players']}/{server['MaxPlayers']}", True),
-                                        ("Region", server["Region"], True)
-                                    ]
-                                )
-                                await channel.send(embed=embed)
-                                alert_states[alert_id]["server_alerts"][server["Name"]] = True
-                        elif below_warning_enabled:
-                            if alert_states[alert_id]["server_alerts"].get(server["Name"], False):
-                                # Ping the role if specified
-                                if ping_role_id:
-                                    await channel.send(f"<@&{ping_role_id}>")
-
-                                embed = create_alert_embed(
-                                    title="🔴 **Server Alert** 🔴",
-                                    description=f"**Server:** {server['Name']} is now below the minimum player count.",
-                                    color=discord.Color.red(),
-                                    fields=[
-                                        ("Players", f"{server['Players']}/{server['MaxPlayers']}", False)
-                                    ]
-                                )
-                                await channel.send(embed=embed)
-                                alert_states[alert_id]["server_alerts"][server["Name"]] = False
-
-                    # Check map alerts
-                    if alert_map and alert_map.lower() == server["Map"].lower():
-                        if server["Players"] >= min_players:
-                            if not alert_states[alert_id]["map_alerts"].get(server["Map"], False):
-                                # Ping the role if specified
-                                if ping_role_id:
-                                    await channel.send(f"<@&{ping_role_id}>")
-
-                                embed = create_alert_embed(
-                                    title="🚨 **Map Alert** 🚨",
-                                    description=f"**Map:** {server['Map']}",
-                                    color=discord.Color.green(),
-                                    fields=[
-                                        ("Server", f"{server['Name']}", True),
-                                        ("Gamemode", server["Gamemode"], True),
-                                        ("Players", f"{server['Players']}/{server['MaxPlayers']}", True),
-                                        ("Region", server["Region"], True)
-                                    ]
-                                )
-                                await channel.send(embed=embed)
-                                alert_states[alert_id]["map_alerts"][server["Map"]] = True
-                        elif below_warning_enabled:
-                            if alert_states[alert_id]["map_alerts"].get(server["Map"], False):
-                                # Ping the role if specified
-                                if ping_role_id:
-                                    await channel.send(f"<@&{ping_role_id}>")
-
-                                embed = create_alert_embed(
-                                    title="🔴 **Map Alert** 🔴",
-                                    description=f"**Map:** {server['Map']} is now below the minimum player count.",
-                                    color=discord.Color.red(),
-                                    fields=[
-                                        ("Server", f"{server['Name']}", False),
-                                        ("Players", f"{server['Players']}/{server['MaxPlayers']}", False)
-                                    ]
-                                )
-                                await channel.send(embed=embed)
-                                alert_states[alert_id]["map_alerts"][server["Map"]] = False
-
-        except Exception as e:
-            print(f"Error fetching data: {e}")
-
-        # Wait for a while before checking again
-        await asyncio.sleep(60)  # Check every 60 seconds
+            stats = await run_monitor_tick(state)
+        except Exception:
+            delay = scheduler.failed()
+            metrics.inc("bsm_poll_failures_total")
+            logger.exception("Error fetching data (retrying in %.0fs)", delay)
+        else:
+            scheduler.succeeded(near_threshold=stats["near_threshold"] > 0)
+
+        # Wait for the next tick on the schedule
+        await scheduler.wait()
+
+# Local metrics endpoint (Prometheus text format); BSM_METRICS_PORT=0 disables it
+METRICS_HOST = os.environ.get("BSM_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("BSM_METRICS_PORT", "9108"))
+metrics_runner = None
+
+# Function to serve /metrics for local scraping (started once)
+async def start_metrics_server():
+    global metrics_runner
+    if metrics_runner is not None or not METRICS_PORT:
+        return
+
+    async def handle_metrics(request):
+        return web.Response(text=metrics.render(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    metrics_runner = web.AppRunner(app, access_log=None)
+    await metrics_runner.setup()
+    try:
+        await web.TCPSite(metrics_runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError:
+        logger.exception("Could not start the metrics endpoint on %s:%d", METRICS_HOST, METRICS_PORT)
+        return
+    logger.info("Serving metrics on http://%s:%d/metrics", METRICS_HOST, METRICS_PORT)
+
+# Function to read a value from the meta table
+def get_meta(key):
+    row = db_conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+# Function to write a value to the meta table
+def set_meta(key, value):
+    db_conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+    db_conn.commit()
+
+# Function to hash the command schema Discord would receive on a sync
+def command_schema_hash():
+    payload = {
+        "application_id": bot.application_id,
+        "commands": [command.to_dict(bot.tree) for command in bot.tree.get_commands()]
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+# Function to sync the slash commands, skipped when the schema is unchanged since the last successful sync.
+# Commands are global, so only the process running shard 0 syncs them.
+async def sync_commands():
+    if SHARD_IDS is not None and 0 not in SHARD_IDS:
+        return
+    schema_hash = command_schema_hash()
+    if schema_hash == await run_db(get_meta, "command_hash"):
+        logger.info("Command schema unchanged, skipping sync")
+        return
+    try:
+        synced = await bot.tree.sync()
+    except Exception:
+        logger.exception("Error syncing commands")
+        return
+    await run_db(set_meta, "command_hash", schema_hash)
+    logger.info("Synced %d command(s)", len(synced))
+
+# How long shutdown waits for queued alerts to go out
+SHUTDOWN_DRAIN_TIMEOUT = 10
+
+# Owns every background task, so each runs exactly once per process no matter how often
+# the gateway reconnects, and shuts them down cleanly (flushing pending sends and state)
+class LifecycleManager:
+    def __init__(self):
+        self.tasks = {}
+        self.started = False
+        self.stopped = False
+
+    def start_task(self, name, coro_func):
+        task = self.tasks.get(name)
+        if task is not None and not task.done():
+            return task
+        task = self.tasks[name] = asyncio.ensure_future(coro_func())
+        task.add_done_callback(functools.partial(self._task_done, name))
+        return task
+
+    def _task_done(self, name, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Background task %s crashed", name, exc_info=task.exception())
+
+    # Function to start the background work (called from setup_hook)
+    async def start(self):
+        if self.started:
+            return
+        self.started = True
+        self.start_task("sync", sync_commands)
+        self.start_task("monitor", monitor_api)
+        await start_metrics_server()
+
+    # Function to stop the background work, then drain queued sends and persist state
+    async def stop(self):
+        if self.stopped or not self.started:
+            return
+        self.stopped = True
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+        try:
+            await asyncio.wait_for(dispatcher.join(), SHUTDOWN_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Shut down with %d alert message(s) still queued", dispatcher.depth)
+        try:
+            await alert_state_store.checkpoint()
+            await player_history.flush()
+        except Exception:
+            logger.exception("Error saving state on shutdown")
+
+        await close_http_session()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        logger.info("Background tasks stopped")
+
+lifecycle = LifecycleManager()
 
 # Run the bot with your token
\ No newline at end of file
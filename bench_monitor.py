@@ -0,0 +1,284 @@
+# Offline replay benchmark for the BSM monitor loop.
+#
+# Serves recorded or synthetic GetServerList snapshots from a local HTTP stand-in,
+# loads a synthetic configs table and runs real monitor ticks against a fake Discord
+# channel sink, so no live API or gateway is needed.
+#
+# Usage:
+#   python bench_monitor.py                          # synthetic list, 10k alerts, 20 ticks
+#   python bench_monitor.py --snapshots recorded/    # replay *.json files in name order
+#   python bench_monitor.py --alerts 50000 --guilds 5000 --ticks 50 --verify
+import argparse
+import asyncio
+import gc
+import gzip
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from aiohttp import web
+
+MAPS = ["Azagor", "Basra", "Construction", "District", "Dustydew", "Equator", "Frugis", "Isle", "Lonovo",
+        "MultiIslands", "Namak", "OilDunes", "River", "Salhan", "SandySunset", "TensaTown", "Valley",
+        "Wakistan", "WineParadise", "ZalfayDesert", "Kodiak", "Old_District", "Old_Namak"]
+REGIONS = ["America_Central", "Europe_Central", "Asia_Central", "Australia_Central", "Brazil_Central", "Japan_Central"]
+GAMEMODES = ["CONQ", "DOMI", "RUSH", "TDM", "FRONTLINE", "INFCONQ", "ELI", "CaptureTheFlag", "VoxelFortify"]
+WORDS = ["Elite", "Soldiers", "Official", "Community", "Hardcore", "Casual", "Tactical", "Noob", "Friendly",
+         "Squad", "Clan", "Vets", "Battle", "Bit", "Chaos", "Night", "Storm", "Iron", "Wolf", "Delta"]
+
+
+# Function to build a synthetic server list shaped like the real API payload
+def synthetic_servers(rng, count):
+    servers = []
+    for index in range(count):
+        max_players = rng.choice([32, 64, 128, 254])
+        servers.append({
+            "Name": f"{rng.choice(WORDS)} {rng.choice(WORDS)} #{index}",
+            "Map": rng.choice(MAPS),
+            "MapSize": rng.choice(["Small", "Medium", "Big", "Ultra"]),
+            "Gamemode": rng.choice(GAMEMODES),
+            "Region": rng.choice(REGIONS),
+            "Players": rng.randint(0, max_players),
+            "QueuePlayers": 0,
+            "MaxPlayers": max_players,
+            "Hz": 60,
+            "DayNight": rng.choice(["Day", "Night"]),
+            "IsOfficial": rng.random() < 0.1,
+            "HasPassword": rng.random() < 0.05,
+            "AntiCheat": "EAC",
+            "Build": "Production 3.2.2",
+        })
+    return servers
+
+
+# Function to derive the next poll from the previous one: a share of servers change
+# player count, a few rotate map, a few disappear and get replaced
+def next_servers(rng, servers, churn):
+    servers = [dict(server) for server in servers]
+    for server in servers:
+        if rng.random() < churn:
+            server["Players"] = max(0, min(server["MaxPlayers"], server["Players"] + rng.randint(-12, 12)))
+        if rng.random() < churn / 10:
+            server["Map"] = rng.choice(MAPS)
+    for _ in range(int(len(servers) * churn / 20)):
+        servers[rng.randrange(len(servers))] = synthetic_servers(rng, 1)[0] | {"Name": f"New {rng.random():.8f}"}
+    return servers
+
+
+# Function to build the synthetic configs table rows
+def synthetic_configs(rng, alerts, guilds, servers, boards):
+    names = [server["Name"] for server in servers]
+    rows = []
+    for _ in range(alerts):
+        guild_id = str(100000 + rng.randrange(guilds))
+        roll = rng.random()
+        alert_name = rng.choice(WORDS + [name[:rng.randint(4, 12)] for name in rng.sample(names, 3)]) if roll < 0.6 else None
+        alert_map = rng.choice(MAPS) if roll > 0.4 else None
+        rows.append((
+            guild_id, alert_name, alert_map, rng.choice([10, 20, 40, 60, 80, 100]),
+            str(1000 + int(guild_id) * 10 + rng.randrange(3)), str(rng.randrange(10 ** 6)) if rng.random() < 0.7 else None,
+            int(rng.random() < 0.3), "board" if rng.random() < boards else "alert"
+        ))
+    return rows
+
+
+# Local stand-in for the BattleBit API, honouring ETag and gzip like the real one
+class FakeBattleBitApi:
+    def __init__(self, payloads):
+        self.payloads = payloads
+        self.position = 0
+        self.requests = 0
+        self.not_modified = 0
+
+    # Function to move on to the next recorded poll (the last one repeats)
+    def advance(self):
+        self.position = min(self.position + 1, len(self.payloads) - 1)
+
+    async def handle(self, request):
+        self.requests += 1
+        body = self.payloads[self.position]
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        headers = {"ETag": etag, "Content-Type": "application/json"}
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, 5)
+            headers["Content-Encoding"] = "gzip"
+        return web.Response(body=body, headers=headers)
+
+
+# Stand-in for a Discord message, only as far as status boards use it
+class FakeMessage:
+    def __init__(self, sink, message_id):
+        self.sink = sink
+        self.id = message_id
+
+    async def edit(self, embed=None):
+        self.sink.edits += 1
+
+    async def pin(self):
+        pass
+
+
+# Stand-in for a Discord text channel that records what would have been sent
+class FakeChannel:
+    def __init__(self, sink, channel_id):
+        self.sink = sink
+        self.id = channel_id
+
+    async def send(self, content=None, embeds=None, embed=None):
+        self.sink.messages += 1
+        self.sink.embeds += len(embeds or ()) + (embed is not None)
+        if content:
+            self.sink.pings += 1
+        return FakeMessage(self.sink, self.sink.messages)
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self.sink, message_id)
+
+
+class FakeSink:
+    def __init__(self):
+        self.channels = {}
+        self.messages = 0
+        self.embeds = 0
+        self.pings = 0
+        self.edits = 0
+
+    def get_channel(self, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = FakeChannel(self, channel_id)
+        return channel
+
+
+# Function to check the matcher against the original nested-loop semantics
+def verify_matcher(BSM, configs, servers):
+    matcher = BSM.AlertMatcher(configs)
+    for server in servers:
+        expected = []
+        for config in configs:
+            if config["alert_name"] and config["alert_name"].lower() in server["Name"].lower():
+                expected.append((config, BSM.MATCH_NAME))
+            if config["alert_map"] and config["alert_map"].lower() == server["Map"].lower():
+                expected.append((config, BSM.MATCH_MAP))
+        if matcher.match(server["Name"].lower(), server["Map"].lower()) != expected:
+            raise AssertionError(f"Matcher disagrees with the nested loop for {server['Name']!r}")
+
+
+def summarize(label, values, scale=1000.0, unit="ms"):
+    values = [value * scale for value in values]
+    return (f"{label:<10} mean {statistics.fmean(values):9.2f}{unit}  p50 {statistics.median(values):9.2f}{unit}"
+            f"  max {max(values):9.2f}{unit}")
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    if args.snapshots:
+        files = sorted(name for name in os.listdir(args.snapshots) if name.endswith(".json"))
+        payloads = []
+        for name in files:
+            with open(os.path.join(args.snapshots, name), "rb") as f:
+                payloads.append(f.read())
+        first = json.loads(payloads[0])
+    else:
+        first = synthetic_servers(rng, args.servers)
+        polls = [first]
+        for _ in range(args.ticks - 1):
+            polls.append(next_servers(rng, polls[-1], args.churn))
+        payloads = [json.dumps(poll).encode() for poll in polls]
+
+    # Import the bot against a throwaway database
+    workdir = tempfile.mkdtemp(prefix="bsm-bench-")
+    os.environ["BSM_DATABASE_FILE"] = os.path.join(workdir, "bench.db")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import BSM
+    import server_list
+
+    rows = synthetic_configs(rng, args.alerts, args.guilds, first, args.boards)
+    BSM.db_conn.executemany(
+        f"INSERT INTO configs ({', '.join(BSM.CONFIG_COLUMNS[1:8])}, mode) VALUES ({', '.join('?' * 8)})", rows
+    )
+    BSM.db_conn.commit()
+    BSM.config_store.load()
+    if args.verify:
+        verify_matcher(BSM, BSM.config_store.all(), first)
+        print("Matcher verified against the nested loop")
+
+    api = FakeBattleBitApi(payloads)
+    app = web.Application()
+    app.router.add_get("/Servers/GetServerList", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    server_list.SERVER_LIST_URL = f"http://127.0.0.1:{port}/Servers/GetServerList"
+
+    sink = FakeSink()
+    dispatcher = BSM.AlertDispatcher()
+    state = BSM.MonitorState(sink.get_channel, dispatcher)
+    ticks = len(payloads) if args.snapshots else args.ticks
+    results = []
+    if args.trace_memory:
+        tracemalloc.start()
+    try:
+        for tick in range(ticks):
+            collections = sum(generation["collections"] for generation in gc.get_stats())
+            if args.trace_memory:
+                tracemalloc.reset_peak()
+            stats = await BSM.run_monitor_tick(state)
+            started = time.perf_counter()
+            await dispatcher.join()
+            stats["send"] = time.perf_counter() - started
+            stats["gc"] = sum(generation["collections"] for generation in gc.get_stats()) - collections
+            stats["peak"] = tracemalloc.get_traced_memory()[1] if args.trace_memory else 0
+            results.append(stats)
+            print(f"tick {tick:3d}: fetch {stats['fetch'] * 1000:8.2f}ms  parse {stats['parse'] * 1000:8.2f}ms"
+                  f"  match {stats['match'] * 1000:8.2f}ms  dispatch {stats['dispatch'] * 1000:7.2f}ms"
+                  f"  send {stats['send'] * 1000:8.2f}ms  evaluated {stats['evaluated']:5d}"
+                  f"  messages {stats['messages']:5d}  bytes {stats['bytes']}  gc {stats['gc']}"
+                  + f"  boards {stats['board_updates']}"
+                  + (f"  peak {stats['peak'] / 1048576:.1f}MiB" if args.trace_memory else ""))
+            api.advance()
+    finally:
+        await server_list.get_http_session().close()
+        await runner.cleanup()
+
+    print()
+    print(f"{len(first)} servers, {len(rows)} alerts across {args.guilds} guilds, {ticks} ticks")
+    for stage in ("fetch", "parse", "match", "dispatch", "send"):
+        print(summarize(stage, [stats[stage] for stats in results]))
+    print(summarize("messages", [stats["messages"] for stats in results], scale=1, unit=""))
+    print(summarize("gc runs", [stats["gc"] for stats in results], scale=1, unit=""))
+    if args.trace_memory:
+        print(summarize("peak", [stats["peak"] for stats in results], scale=1 / 1048576, unit="MiB"))
+    print(f"decoder: {'msgspec' if server_list.msgspec is not None else 'json'}")
+    print(f"upstream requests {api.requests} (304: {api.not_modified}), messages sent {sink.messages},"
+          f" embeds {sink.embeds}, pings {sink.pings}, board edits {sink.edits}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay server-list snapshots through the BSM monitor offline.")
+    parser.add_argument("--snapshots", help="Directory of recorded GetServerList *.json files to replay in name order.")
+    parser.add_argument("--servers", type=int, default=1000, help="Servers in the synthetic list.")
+    parser.add_argument("--alerts", type=int, default=10000, help="Synthetic alert configs.")
+    parser.add_argument("--guilds", type=int, default=2000, help="Guilds the alerts are spread across.")
+    parser.add_argument("--ticks", type=int, default=20, help="Synthetic polls to replay.")
+    parser.add_argument("--churn", type=float, default=0.1, help="Share of servers changing player count per poll.")
+    parser.add_argument("--boards", type=float, default=0.0, help="Share of alerts using status board mode.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verify", action="store_true", help="Cross-check the matcher against the nested loop first.")
+    parser.add_argument("--trace-memory", action="store_true", help="Report peak traced memory per tick (slows every stage down).")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
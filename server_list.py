@@ -0,0 +1,159 @@
+# BattleBit server list: download, decoding and the snapshot file publisher.
+#
+# Kept apart from BSM.py so snapshot_fetcher.py can use it without building the bot,
+# opening the database or loading any configs.
+import aiohttp
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+try:
+    import msgspec  # Optional: faster, schema-aware decoding of the server list
+except ImportError:
+    msgspec = None
+
+logger = logging.getLogger("bsm")
+
+# BattleBit API setup
+SERVER_LIST_URL = "https://publicapi.battlebit.cloud/Servers/GetServerList"
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=20, connect=5, sock_read=15)
+
+# Shared HTTP session, created on first use so it binds to the running event loop
+http_session = None
+
+# Function to get the shared keep-alive HTTP session
+def get_http_session():
+    global http_session
+    if http_session is None or http_session.closed:
+        connector = aiohttp.TCPConnector(limit=10, keepalive_timeout=75, ttl_dns_cache=300)
+        http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=HTTP_TIMEOUT,
+            headers={"Accept-Encoding": "gzip, deflate", "User-Agent": "BSM-Discord-Bot"}
+        )
+    return http_session
+
+# Function to close the shared HTTP session, if one is open
+async def close_http_session():
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+
+# Compact, read-only record for one server in the list.
+# Lowercased keys are computed once per snapshot and the low-cardinality strings are interned,
+# so every snapshot shares a single copy of each map/region/gamemode name.
+class ServerRecord:
+    __slots__ = ("name", "map", "gamemode", "region", "players", "max_players",
+                 "name_key", "map_key", "region_key", "gamemode_key")
+
+    def __init__(self, name, map, gamemode, region, players, max_players):
+        self.name = name
+        self.map = sys.intern(map)
+        self.gamemode = sys.intern(gamemode)
+        self.region = sys.intern(region)
+        self.players = players
+        self.max_players = max_players
+        self.name_key = name.lower()
+        self.map_key = sys.intern(map.lower())
+        self.region_key = sys.intern(region.lower())
+        self.gamemode_key = sys.intern(gamemode.lower())
+
+    def __eq__(self, other):
+        if not isinstance(other, ServerRecord):
+            return NotImplemented
+        return (self.name == other.name and self.players == other.players and self.map == other.map and
+                self.max_players == other.max_players and self.gamemode == other.gamemode and self.region == other.region)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"ServerRecord({self.name!r}, {self.map!r}, {self.players}/{self.max_players})"
+
+# Only the fields the bot uses are decoded; msgspec skips the rest of each object without building it
+if msgspec is not None:
+    class ServerPayload(msgspec.Struct, rename="pascal", gc=False):
+        name: str
+        map: str
+        gamemode: str
+        region: str
+        players: int
+        max_players: int
+
+    server_list_decoder = msgspec.json.Decoder(list[ServerPayload])
+
+# Function to decode a GetServerList payload into ServerRecords
+def decode_server_list(body):
+    if msgspec is not None:
+        return tuple(
+            ServerRecord(server.name, server.map, server.gamemode, server.region, server.players, server.max_players)
+            for server in server_list_decoder.decode(body)
+        )
+    return tuple(
+        ServerRecord(server["Name"], server["Map"], server["Gamemode"], server["Region"], server["Players"], server["MaxPlayers"])
+        for server in json.loads(body)
+    )
+
+# Function to download the raw server list.
+# Returns (body, etag, last_modified); body is None when upstream reports the list unchanged.
+async def download_server_list(etag=None, last_modified=None):
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    async with get_http_session().get(SERVER_LIST_URL, headers=headers) as response:
+        if response.status == 304:
+            return None, etag, last_modified
+        response.raise_for_status()
+        body = await response.read()
+        return body, response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+# Snapshot file setup (see snapshot_fetcher.py)
+SNAPSHOT_PUBLISH_INTERVAL = int(os.environ.get("BSM_SNAPSHOT_PUBLISH_INTERVAL", "30"))
+SNAPSHOT_PUBLISH_BACKOFF_MAX = 600
+
+def read_file_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+# Function to replace the snapshot file atomically, so readers never see a partial write
+def write_snapshot_file(path, body):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+# Function to fetch the list once for every bot worker and publish it to a local file.
+# Upstream sees one poller no matter how many shard processes read the file.
+async def run_snapshot_publisher(path, interval=SNAPSHOT_PUBLISH_INTERVAL):
+    loop = asyncio.get_running_loop()
+    etag = last_modified = None
+    failures = 0
+    next_tick = loop.time()
+    logger.info("Publishing the server list to %s every %ds", path, interval)
+    try:
+        while True:
+            try:
+                body, new_etag, new_last_modified = await download_server_list(etag, last_modified)
+                if body is not None:
+                    # Make sure the payload decodes before any worker sees it
+                    servers = await asyncio.to_thread(decode_server_list, body)
+                    await asyncio.to_thread(write_snapshot_file, path, body)
+                    etag, last_modified = new_etag, new_last_modified
+                    logger.debug("Published %d servers (%d bytes)", len(servers), len(body))
+            except Exception:
+                # Back off with jitter, like the bot's own poller
+                failures += 1
+                ceiling = min(SNAPSHOT_PUBLISH_BACKOFF_MAX, interval * 2 ** (failures - 1))
+                delay = random.uniform(ceiling / 2, ceiling)
+                next_tick = loop.time() + delay
+                logger.exception("Error publishing the server list (retrying in %.0fs)", delay)
+            else:
+                failures = 0
+                next_tick = max(next_tick + interval, loop.time())
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+    finally:
+        await close_http_session()
@@ -0,0 +1,30 @@
+# Dedicated server-list fetcher for sharded deployments.
+#
+# Polls the BattleBit API once and publishes every new list to a local file that all
+# bot workers read (start them with the same BSM_SNAPSHOT_FILE), so upstream load stays
+# constant however many shard processes run. Example with two worker processes:
+#
+#   BSM_SNAPSHOT_FILE=/run/bsm/servers.json python snapshot_fetcher.py
+#   BSM_SNAPSHOT_FILE=/run/bsm/servers.json BSM_SHARD_COUNT=4 BSM_SHARD_IDS=0,1 python your_bot.py
+#   BSM_SNAPSHOT_FILE=/run/bsm/servers.json BSM_SHARD_COUNT=4 BSM_SHARD_IDS=2,3 python your_bot.py
+#
+# Only server_list is imported, so the fetcher never builds the bot or touches the configs database.
+import asyncio
+import logging
+import os
+import sys
+
+import server_list
+
+
+def main():
+    path = os.environ.get("BSM_SNAPSHOT_FILE")
+    if not path:
+        sys.exit("Set BSM_SNAPSHOT_FILE to the path the bot workers read the server list from.")
+    logging.basicConfig(format="%(asctime)s %(levelname)-8s %(name)s: %(message)s")
+    logging.getLogger("bsm").setLevel(os.environ.get("BSM_LOG_LEVEL", "INFO").upper())
+    asyncio.run(server_list.run_snapshot_publisher(path))
+
+
+if __name__ == "__main__":
+    main()
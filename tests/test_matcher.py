@@ -0,0 +1,78 @@
+# Checks AlertMatcher against the nested loop it replaced:
+#   alert_name.lower() in server_name.lower() and alert_map.lower() == server_map.lower()
+import os
+import random
+import sys
+import tempfile
+
+import pytest
+
+# Importing the bot opens its database, so point it at a throwaway file first
+os.environ.setdefault("BSM_DATABASE_FILE", os.path.join(tempfile.mkdtemp(prefix="bsm-test-"), "test.db"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import BSM
+
+# Small alphabet so random patterns overlap, nest and repeat; includes characters whose lowercase differs in length
+ALPHABET = "abAB #-ßẞİıÅåΣσς"
+
+
+def make_config(alert_id, alert_name=None, alert_map=None):
+    return {"alert_id": alert_id, "alert_name": alert_name, "alert_map": alert_map}
+
+
+def nested_loop(configs, name, map):
+    expected = []
+    for config in configs:
+        if config["alert_name"] and config["alert_name"].lower() in name.lower():
+            expected.append((config, BSM.MATCH_NAME))
+        if config["alert_map"] and config["alert_map"].lower() == map.lower():
+            expected.append((config, BSM.MATCH_MAP))
+    return expected
+
+
+def random_text(rng, max_length):
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, max_length)))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_nested_loop_on_random_patterns(seed):
+    rng = random.Random(seed)
+    configs = [
+        make_config(
+            alert_id,
+            rng.choice([None, "", random_text(rng, 4)]),
+            rng.choice([None, "", random_text(rng, 2)])
+        )
+        for alert_id in range(rng.randint(1, 40))
+    ]
+    matcher = BSM.AlertMatcher(configs)
+    for _ in range(200):
+        name, map = random_text(rng, 12), random_text(rng, 2)
+        assert matcher.match(name.lower(), map.lower()) == nested_loop(configs, name, map)
+
+
+def test_overlapping_and_nested_patterns():
+    configs = [make_config(1, "he"), make_config(2, "she"), make_config(3, "his"), make_config(4, "hers"),
+               make_config(5, "e"), make_config(6, "She")]
+    matcher = BSM.AlertMatcher(configs)
+    for name in ("ushers", "she", "hishers", "h", ""):
+        assert matcher.match(name.lower(), "") == nested_loop(configs, name, "")
+
+
+def test_empty_and_missing_patterns_never_match():
+    configs = [make_config(1), make_config(2, "", ""), make_config(3, None, "")]
+    matcher = BSM.AlertMatcher(configs)
+    assert matcher.match("elite soldiers", "") == []
+
+
+def test_unicode_case_folding_follows_lower():
+    configs = [make_config(1, "STRASSE"), make_config(2, "straße"), make_config(3, "İstanbul"), make_config(4, None, "ΣΑΣ")]
+    matcher = BSM.AlertMatcher(configs)
+    for name, map in (("Straße Kings", "σας"), ("STRASSE", "ΣΑΣ"), ("İSTANBUL 1", "σασ"), ("istanbul", "")):
+        assert matcher.match(name.lower(), map.lower()) == nested_loop(configs, name, map)
+
+
+def test_same_pattern_in_several_configs_keeps_table_order():
+    configs = [make_config(3, "elite"), make_config(1, "Elite", "Basra"), make_config(2, "ELITE")]
+    matcher = BSM.AlertMatcher(configs)
+    assert matcher.match("elite soldiers", "basra") == nested_loop(configs, "Elite Soldiers", "Basra")
@@ -0,0 +1,206 @@
+# Drives run_monitor_tick over scripted player counts: the server list download is stubbed out
+# and alerts land on a fake channel instead of Discord
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Importing the bot opens its database, so point it at a throwaway file first
+os.environ.setdefault("BSM_DATABASE_FILE", os.path.join(tempfile.mkdtemp(prefix="bsm-test-"), "test.db"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import BSM
+from server_list import ServerRecord
+
+GUILD_ID = "1"
+CHANNEL_ID = 100
+
+
+def server(name, players, map="Basra", region="EU"):
+    return ServerRecord(name, map, "CONQ", region, players, 64)
+
+
+# Stand-in for a Discord message, only as far as status boards use it
+class FakeMessage:
+    def __init__(self, channel, message_id):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, embed=None):
+        self.channel.boards.append(embed)
+
+    async def pin(self):
+        pass
+
+
+# Stand-in for a Discord text channel that keeps what would have been sent
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.alerts = []  # Embeds of every alert message, in order
+        self.boards = []  # Every status board posted or edited
+
+    async def send(self, content=None, embeds=None, embed=None):
+        self.alerts.extend(embeds or ())
+        if embed is not None:
+            self.boards.append(embed)
+        return FakeMessage(self, len(self.boards))
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self, message_id)
+
+
+# One monitor with its own stores, fed the servers each tick should see
+class Monitor:
+    def __init__(self):
+        self.servers = ()
+        self.channel = FakeChannel(CHANNEL_ID)
+        self.state = None
+
+    async def fetch(self):
+        return self.servers
+
+    def get_channel(self, channel_id):
+        return self.channel if channel_id == CHANNEL_ID else None
+
+    # Function to run one tick over the given servers.
+    # Returns the alerts it sent, as "on"/"off" per embed.
+    async def tick(self, *servers):
+        if self.state is None:
+            self.state = BSM.MonitorState(self.get_channel, BSM.AlertDispatcher())
+        self.servers = servers
+        sent = len(self.channel.alerts)
+        await BSM.run_monitor_tick(self.state)
+        await self.state.dispatcher.join()
+        return ["off" if "🔴" in embed.title else "on" for embed in self.channel.alerts[sent:]]
+
+    # Function to run one tick per player count of a single server
+    async def run_counts(self, counts, name="Alpha"):
+        return [await self.tick(server(name, players)) for players in counts]
+
+
+@pytest.fixture
+def monitor(monkeypatch):
+    # Fresh stores, so alerts and states from other tests do not leak in
+    monkeypatch.setattr(BSM, "config_store", BSM.ConfigStore())
+    monkeypatch.setattr(BSM, "alert_state_store", BSM.AlertStateStore())
+    monkeypatch.setattr(BSM, "board_store", BSM.BoardStore())
+    monkeypatch.setattr(BSM, "player_history", BSM.PlayerHistory())
+    monkeypatch.setattr(BSM, "current_snapshot", None)
+    monkeypatch.setattr(BSM, "snapshot_refresh", None)
+    monitor = Monitor()
+    monkeypatch.setattr(BSM, "fetch_server_list", monitor.fetch)
+    return monitor
+
+
+async def add_alert(alert_name=None, alert_map=None, min_players=50, **options):
+    return await BSM.config_store.add(GUILD_ID, alert_name, alert_map, min_players, str(CHANNEL_ID), **options)
+
+
+def test_threshold_alert_fires_and_clears_across_the_band(monitor):
+    async def scenario():
+        await add_alert("Alpha", clear_players=40, below_warning_enabled=True)
+        return await monitor.run_counts([55, 45, 35, 45, 52, 38])
+
+    assert asyncio.run(scenario()) == [["on"], [], ["off"], [], ["on"], ["off"]]
+
+
+def test_alert_clears_silently_without_below_warning(monitor):
+    async def scenario():
+        config = await add_alert("Alpha")
+        fired = await monitor.run_counts([55, 30, 55])
+        return fired, BSM.alert_state_store.is_active(config["alert_id"], BSM.MATCH_NAME, "Alpha")
+
+    # The alert still clears below the threshold, so it can fire again
+    assert asyncio.run(scenario()) == ([["on"], [], ["on"]], True)
+
+
+def test_sustain_ticks_waits_for_a_steady_count(monitor):
+    async def scenario():
+        await add_alert("Alpha", below_warning_enabled=True, sustain_ticks=2)
+        # An unchanged list still counts towards the sustain time; a count going back resets it
+        return await monitor.run_counts([55, 55, 30, 55, 56, 30, 30])
+
+    assert asyncio.run(scenario()) == [[], ["on"], [], [], [], [], ["off"]]
+
+
+def test_pending_change_expires_when_the_server_leaves(monitor):
+    async def scenario():
+        await add_alert("Alpha", sustain_ticks=2)
+        fired = [await monitor.tick(server("Alpha", 55)), await monitor.tick()]
+        pending = dict(monitor.state.pending)
+        fired += await monitor.run_counts([55, 55])
+        return fired, pending
+
+    assert asyncio.run(scenario()) == ([[], [], [], ["on"]], {})
+
+
+def test_map_alert_follows_the_busiest_server(monitor):
+    async def scenario():
+        await add_alert(alert_map="Basra", below_warning_enabled=True)
+        fired = [
+            await monitor.tick(server("Alpha", 60), server("Bravo", 10), server("Charlie", 64, map="Valley")),
+            # Alpha emptying does not clear the map while Bravo keeps it busy
+            await monitor.tick(server("Alpha", 20), server("Bravo", 55), server("Charlie", 64, map="Valley")),
+            await monitor.tick(server("Alpha", 20), server("Bravo", 30), server("Charlie", 64, map="Valley"))
+        ]
+        return fired, [embed.fields[0].value for embed in monitor.channel.alerts]
+
+    fired, busiest = asyncio.run(scenario())
+    assert fired == [["on"], [], ["off"]]
+    assert busiest == ["Alpha", "Bravo"]
+
+
+def test_map_alert_sustain_with_several_servers(monitor):
+    async def scenario():
+        await add_alert(alert_map="Basra", below_warning_enabled=True, sustain_ticks=2)
+        # Only one of the map's servers changes on the second tick, the other still waits out the sustain time
+        return [
+            await monitor.tick(server("Alpha", 60), server("Bravo", 10)),
+            await monitor.tick(server("Alpha", 60), server("Bravo", 11)),
+            await monitor.tick(server("Alpha", 10), server("Bravo", 11)),
+            await monitor.tick(server("Alpha", 10), server("Bravo", 12))
+        ]
+
+    assert asyncio.run(scenario()) == [[], ["on"], [], ["off"]]
+
+
+def test_board_rows_survive_an_unrelated_edit(monitor):
+    async def scenario():
+        kept = await add_alert("Alpha", clear_players=40, mode=BSM.MODE_BOARD)
+        edited = await add_alert("Bravo", mode=BSM.MODE_BOARD)
+        await monitor.tick(server("Alpha", 55), server("Bravo", 60))
+        # Alpha drops into the band and stays shown
+        await monitor.tick(server("Alpha", 45), server("Bravo", 60))
+        shown = [set(monitor.state.boards.rows[CHANNEL_ID])]
+
+        # Editing Bravo's alert re-checks only that alert, Alpha's row carries over
+        await BSM.config_store.update(edited["alert_id"], min_players=70)
+        await monitor.tick(server("Alpha", 45), server("Bravo", 60))
+        shown.append(set(monitor.state.boards.rows[CHANNEL_ID]))
+
+        await BSM.config_store.update(edited["alert_id"], min_players=50)
+        await monitor.tick(server("Alpha", 45), server("Bravo", 60))
+        await BSM.config_store.delete(edited["alert_id"])
+        await monitor.tick(server("Alpha", 45), server("Bravo", 60))
+        shown.append(set(monitor.state.boards.rows[CHANNEL_ID]))
+        return kept["alert_id"], edited["alert_id"], shown
+
+    kept, edited, shown = asyncio.run(scenario())
+    alpha = (kept, BSM.MATCH_NAME, "EU", "Alpha")
+    bravo = (edited, BSM.MATCH_NAME, "EU", "Bravo")
+    assert shown == [{alpha, bravo}, {alpha}, {alpha}]
+    assert BSM.alert_state_store.is_active(kept, BSM.MATCH_NAME, "Alpha")
+    assert not BSM.alert_state_store.is_active(edited, BSM.MATCH_NAME, "Bravo")
+
+
+def test_history_keeps_same_named_servers_apart_by_region():
+    history = BSM.PlayerHistory()
+    for minute, (eu, us) in enumerate([(10, 40), (30, 35), (50, 20)]):
+        history.record([server("Alpha", eu, region="EU"), server("Alpha", us, region="US")], now=1_000_000 + minute * 60)
+
+    assert history.gain(server("Alpha", 50, region="EU"), 600) == 40
+    assert history.gain(server("Alpha", 20, region="US"), 600) == 0
+    assert history.find(BSM.MATCH_NAME, "alpha", region="us") == "US/Alpha"
+    assert history.find(BSM.MATCH_NAME, "alp") in ("EU/Alpha", "US/Alpha")